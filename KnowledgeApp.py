@@ -7,13 +7,14 @@ import textwrap
 from uuid import uuid4
 from langchain.llms import HuggingFaceEndpoint
 from langchain.chains import RetrievalQA
-from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from PyPDF2 import PdfReader
 import pyttsx3
 import tempfile
+from ingestion import iter_document_segments
+from knowledge_index import CHUNK_OVERLAP, CHUNK_SIZE, load_embeddings, split_segments
 
 # Create temp directory if it doesn't exist
 TEMP_DIR = "C:/temp/podcast_app"
@@ -154,9 +155,20 @@ def init_session_state():
 # Initialize knowledge base
 def init_knowledge_base():
     if not st.session_state.knowledge_base_initialized and st.session_state.documents:
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        texts = [doc['content'] for doc in st.session_state.documents]
-        metadatas = [{'source': doc['title'], 'type': doc['type']} for doc in st.session_state.documents]
+        # Same model and chunking as the shared index, so chunks already
+        # embedded by either app are served from the embedding cache
+        embeddings = load_embeddings()
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        texts = []
+        metadatas = []
+        for doc in st.session_state.documents:
+            if doc.get('file_path'):
+                segments = iter_document_segments(doc)
+            else:
+                segments = [(None, doc['content'])]
+            for page, chunk in split_segments(splitter, segments):
+                texts.append(chunk)
+                metadatas.append({'source': doc['title'], 'type': doc['type'], 'page': page})
         st.session_state.vector_store = FAISS.from_texts(texts, embeddings, metadatas=metadatas)
         st.session_state.knowledge_base_initialized = True
 
@@ -1,24 +1,35 @@
 import streamlit as st
 import pandas as pd
+import atexit
 import os
 import datetime
 from fpdf import FPDF
-import textwrap
 from uuid import uuid4
-from langchain.llms import HuggingFaceEndpoint
-from langchain.chains import RetrievalQA
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.document_loaders import PyPDFLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from PyPDF2 import PdfReader
-import pyttsx3
+from langchain.document_loaders import TextLoader
 import tempfile
+import shutil
+import threading
+import time
+from knowledge_index import (
+    KnowledgeIndex, FaqVectorIndex, INDEX_DIR, FAQ_DUPLICATE_THRESHOLD, FAQ_SIMILAR_THRESHOLD,
+)
+from ingestion import IngestionWorkers
+from bulk_import import BulkImporter
+from keyword_index import FaqSearchIndex
+from metadata_store import MetadataStore, JOB_INDEXED, JOB_FAILED, JOB_QUEUED, PODCAST_ACTIVE_STATUSES
+from llm_backends import load_backend
+from llm_cache import CachedBackend
+from rag import RagPipeline
+from podcast import PodcastJobs
+from media_server import MEDIA_URL, MediaServer
 
 # Create temp directory if it doesn't exist
 TEMP_DIR = "C:/temp/podcast_app"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Uploads are copied to disk in blocks of this size
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
 # Initialize Hugging Face (replace with your API token)
 HUGGINGFACE_API_TOKEN = "API"
 
@@ -147,60 +158,78 @@ def load_css():
             background-color: var(--warning);
             color: white;
         }
+        
+        .tag-danger {
+            background-color: var(--danger);
+            color: white;
+        }
     </style>
     """, unsafe_allow_html=True)
 
 # Initialize session state
 def init_session_state():
-    if 'documents' not in st.session_state:
-        st.session_state.documents = []
-    if 'faqs' not in st.session_state:
-        st.session_state.faqs = []
-    if 'handovers' not in st.session_state:
-        st.session_state.handovers = []
-    if 'vector_store' not in st.session_state:
-        st.session_state.vector_store = None
     if 'knowledge_base_initialized' not in st.session_state:
         st.session_state.knowledge_base_initialized = False
 
+# Documents, FAQs and handovers live in SQLite, shared by all sessions
+@st.cache_resource
+def get_metadata_store():
+    return MetadataStore()
+
+# One embedding model and vector index per process, shared by every session
+@st.cache_resource
+def get_knowledge_index():
+    index = KnowledgeIndex(index_dir=INDEX_DIR)
+    # Memory-maps the saved index; stale or corrupt files are rebuilt in the background
+    reason = index.load()
+    if reason:
+        print(f"Rebuilding knowledge index: {reason}")
+    # Uploads and deletes are journaled; fold them into a snapshot on the way out
+    atexit.register(index.compact)
+    return index
+
+# Background workers that extract, chunk and embed uploads, shared by every session
+@st.cache_resource
+def get_ingestion_workers():
+    workers = IngestionWorkers(get_metadata_store(), get_knowledge_index())
+    workers.start()
+    return workers
+
 # Initialize knowledge base
 def init_knowledge_base():
-    if not st.session_state.knowledge_base_initialized and st.session_state.documents:
-        try:
-            # Initialize embeddings with explicit device and reduced model if needed
-            embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/paraphrase-MiniLM-L3-v2",
-                model_kwargs={'device': 'cpu'},  # Force CPU if GPU issues occur
-                #encode_kwargs={'normalize_embeddings': False}
-            )
-            
-            texts = [doc['content'] for doc in st.session_state.documents]
-            metadatas = [{'source': doc['title'], 'type': doc['type']} for doc in st.session_state.documents]
-            
-            # Create FAISS index in smaller batches if needed
-            st.session_state.vector_store = FAISS.from_texts(
-                texts, 
-                embeddings, 
-                metadatas=metadatas
-            )
-            st.session_state.knowledge_base_initialized = True
-        except Exception as e:
-            st.error(f"Failed to initialize knowledge base: {str(e)}")
-            # Fallback to simple text storage if embedding fails
-            st.session_state.knowledge_base_initialized = False
+    # Documents the shared index has not seen yet (e.g. after the index was
+    # lost) are queued for the background workers once per session
+    if st.session_state.knowledge_base_initialized:
+        return
+    store = get_metadata_store()
+    doc_ids = store.document_ids()
+    if doc_ids:
+        index = get_knowledge_index()
+        if index.status == "rebuilding":
+            return
+        jobs = store.ingestion_statuses(doc_ids)
+        workers = get_ingestion_workers()
+        for doc_id in doc_ids:
+            job = jobs.get(doc_id)
+            if doc_id not in index and (job is None or job['status'] == JOB_INDEXED):
+                workers.submit(doc_id)
+    st.session_state.knowledge_base_initialized = True
 
-# Document repository functions
-def save_document(file, title, description, tags, doc_type):
+def save_document(file, title, description, tags, doc_type, replace_existing=False):
 
       # 👇 Add this debug line here
     print("Current Working Directory:", os.getcwd())
 
-    file_id = str(uuid4())
+    store = get_metadata_store()
+    existing = store.find_document_by_title(title) if replace_existing else None
+    file_id = existing['id'] if existing else str(uuid4())
     file_path = os.path.join("documents", f"{file_id}_{file.name}")
 
     os.makedirs("documents", exist_ok=True)
+    # Written in fixed-size blocks rather than as one buffer copy
+    file.seek(0)
     with open(file_path, "wb") as f:
-        f.write(file.getbuffer())
+        shutil.copyfileobj(file, f, UPLOAD_BLOCK_SIZE)
     
     document = {
         "id": file_id,
@@ -213,29 +242,53 @@ def save_document(file, title, description, tags, doc_type):
         "uploaded_by": "Current User"  # Replace with actual user
     }
     
-    # Extract content based on file type
-    if file.name.endswith('.txt'):
-        with open(file_path, "r", encoding='utf-8') as f:
-            document['content'] = f.read()
-    elif file.name.endswith('.pdf'):
-        try:
-            loader = PyPDFLoader(file_path)
-            pages = loader.load()
-            document['content'] = "\n".join([page.page_content for page in pages])
-        except Exception as e:
-            st.error(f"Error loading PDF: {str(e)}")
-            document['content'] = description
-    else:
-        document['content'] = description
-    
-    st.session_state.documents.append(document)
-    st.session_state.knowledge_base_initialized = False
+    if existing and existing['file_path'] != file_path and os.path.exists(existing['file_path']):
+        # Re-upload: the record keeps its id so only this document's vectors are replaced
+        os.remove(existing['file_path'])
+    store.save_document(document)
+    # Text extraction, chunking and embedding happen in the background
+    get_ingestion_workers().submit(document['id'])
     return document
 
-def get_documents_by_type(doc_type=None):
-    if doc_type:
-        return [doc for doc in st.session_state.documents if doc['type'] == doc_type]
-    return st.session_state.documents
+def delete_document(doc_id):
+    store = get_metadata_store()
+    document = store.get_document(doc_id)
+    if document is None:
+        return False
+    store.delete_document(doc_id)
+    get_knowledge_index().remove_document(doc_id)
+    if os.path.exists(document['file_path']):
+        os.remove(document['file_path'])
+    return True
+
+# Bulk imports run on background threads; their progress is visible to every session
+@st.cache_resource
+def get_bulk_imports():
+    return {}
+
+def run_bulk_import(importer, source, source_name, remove_source):
+    try:
+        importer.run(source, source_name=source_name)
+    finally:
+        if remove_source:
+            os.remove(source)
+
+def start_bulk_import(source, doc_type, tags, source_name=None, remove_source=False):
+    importer = BulkImporter(get_metadata_store(), get_knowledge_index(), doc_type=doc_type, tags=tags)
+    get_bulk_imports()[str(uuid4())] = {"source": source_name or source, "importer": importer}
+    threading.Thread(
+        target=run_bulk_import, args=(importer, source, source_name, remove_source), daemon=True
+    ).start()
+    return importer
+
+def get_filtered_documents(filters):
+    return get_metadata_store().list_documents(
+        tags=filters.get('tags'),
+        uploaded_by=filters.get('uploaded_by'),
+        date_from=filters.get('date_from'),
+        date_to=filters.get('date_to'),
+        doc_type=(filters.get('type') or [None])[0],
+    )
 
 # Handover template functions
 def create_handover_template(employee_name, last_working_day, projects):
@@ -254,7 +307,7 @@ def create_handover_template(employee_name, last_working_day, projects):
             "knowledge_transfer": ""
         }
     }
-    st.session_state.handovers.append(template)
+    get_metadata_store().save_handover(template)
     return template
 
 def generate_handover_pdf(handover):
@@ -292,6 +345,42 @@ def generate_handover_pdf(handover):
     return output_path
 
 # FAQ functions
+# FAQ search index shared by every session, built once from the store
+@st.cache_resource
+def get_faq_index():
+    index = FaqSearchIndex()
+    for faq in get_metadata_store().list_faqs():
+        index.add(faq)
+    return index
+
+# Semantic index over FAQ questions, sharing the knowledge index's embedding model
+@st.cache_resource
+def get_faq_vector_index():
+    index = FaqVectorIndex(get_knowledge_index().embeddings)
+    index.add_many(get_metadata_store().list_faqs())
+    return index
+
+def search_faqs(query):
+    store = get_metadata_store()
+    if not query:
+        return store.list_faqs()
+    faq_ids = get_faq_index().search(query)
+    # Keyword matches first, then questions that mean the same thing in other words
+    for faq_id, _ in get_faq_vector_index().similar(query, k=10):
+        if faq_id not in faq_ids:
+            faq_ids.append(faq_id)
+    return store.get_faqs(faq_ids)
+
+def find_similar_faqs(question, threshold=FAQ_SIMILAR_THRESHOLD):
+    """Existing FAQs close to a question, as (faq, similarity) pairs, best first."""
+    matches = get_faq_vector_index().similar(question, k=5, threshold=threshold)
+    similarity = dict(matches)
+    return [(faq, similarity[faq['id']]) for faq in get_metadata_store().get_faqs([faq_id for faq_id, _ in matches])]
+
+def upvote_faq(faq):
+    get_metadata_store().upvote_faq(faq['id'])
+    get_faq_index().update_popularity(faq['id'], faq['upvotes'] + 1, faq['views'])
+
 def add_faq(question, answer, tags):
     faq = {
         "id": str(uuid4()),
@@ -303,89 +392,181 @@ def add_faq(question, answer, tags):
         "upvotes": 0,
         "views": 0
     }
-    st.session_state.faqs.append(faq)
+    get_metadata_store().save_faq(faq)
+    get_faq_index().add(faq)
+    get_faq_vector_index().add_many([faq])
+    return faq
+
+def merge_faq(faq, answer, tags):
+    """Fold a near-duplicate submission into an existing FAQ."""
+    if answer.strip() and answer.strip() not in faq['answer']:
+        faq['answer'] = f"{faq['answer']}\n\n{answer.strip()}"
+    faq['tags'] = faq['tags'] + [tag for tag in tags if tag not in faq['tags']]
+    get_metadata_store().save_faq(faq)
+    get_faq_index().add(faq)
     return faq
 
 # AI functions
+# LLM backend chosen by KP_LLM_BACKEND (see llm_backends.py), loaded once per process.
+# Answers are cached on disk and identical concurrent requests share one call.
+# The Dashboard and AI Recommendations page share it, and with it one pooled client.
+@st.cache_resource
+def get_llm_backend():
+    return CachedBackend(load_backend(api_token=HUGGINGFACE_API_TOKEN))
+
 def generate_ai_recommendations(query):
-    try:
-        llm = HuggingFaceEndpoint(
-            repo_id="mistralai/Mistral-7B-Instruct-v0.3",
-            task="text-generation",
-            max_new_tokens=512,
-            top_k=10,
-            top_p=0.95,
-            temperature=0.3,
-            huggingfacehub_api_token=HUGGINGFACE_API_TOKEN
-        )
-        
-        prompt = f"""
-        [INST] As a knowledge management consultant, provide 3-5 actionable recommendations for:
-        {query}
-        
-        Use bullet points and professional language. Focus on knowledge continuity and transfer. [/INST]
-        """
-        
-        return llm.invoke(prompt)
-    except Exception as e:
-        return f"Could not generate recommendations: {str(e)}"
+    """Retrieve excerpts for the query and start an answer; stream it with .stream()."""
+    return RagPipeline(get_knowledge_index(), get_llm_backend()).ask(query)
 
-def search_knowledge_base(query):
-    if st.session_state.vector_store:
-        return st.session_state.vector_store.similarity_search(query, k=3)
-    return []
+def show_recommendations(query, header="Recommendations"):
+    """Stream recommendations into a card as they are generated."""
+    placeholder = st.empty()
+
+    def render(text):
+        text = text.replace("\n", "<br>")
+        placeholder.markdown(f"""
+        <div class="card">
+            <div class="card-header">{header}</div>
+            {text}
+        </div>
+        """, unsafe_allow_html=True)
 
-# Text-to-speech functions
-def init_tts_engine():
     try:
-        engine = pyttsx3.init()
-        voices = engine.getProperty('voices')
-        return engine, voices
+        with st.spinner("Analyzing with AI..."):
+            answer = generate_ai_recommendations(query)
+            pieces = answer.stream()
+            # The spinner stays up until the first token arrives
+            first = next(pieces, "")
+        render(first)
+        for _ in pieces:
+            render(answer.text)
     except Exception as e:
-        st.error(f"Failed to initialize TTS engine: {str(e)}")
-        return None, None
+        render(f"Could not generate recommendations: {str(e)}")
+        return
+    if answer.sources:
+        st.caption("Sources: " + "; ".join(
+            f"[{source['number']}] {source['source']}" + (f" p. {source['page']}" if source['page'] else "")
+            for source in answer.sources
+        ))
+    st.caption(
+        f"First token after {answer.first_token_seconds or answer.total_seconds:.2f}s "
+        f"(retrieval {answer.retrieval_seconds * 1000:.0f} ms), {answer.total_seconds:.1f}s total; "
+        f"{answer.prompt_tokens} prompt tokens via {answer.backend.name}"
+    )
 
-engine, voices = init_tts_engine()
+def search_knowledge_base(query, k=3, page=0, mode="hybrid", filters=None):
+    """Return (results, has_more) for one page of k documents."""
+    results = get_knowledge_index().search_documents(query, k=k + 1, offset=page * k, mode=mode, filters=filters)
+    return results[:k], len(results) > k
 
-def generate_podcast(text):
-    """Generate podcast audio using pyttsx3"""
-    if engine is None:
-        st.error("TTS engine not initialized")
-        return None
+# Podcasts are synthesized by background workers, shared by every session
+@st.cache_resource
+def get_podcast_jobs():
+    jobs = PodcastJobs(get_metadata_store(), os.path.join(TEMP_DIR, "podcasts"))
+    jobs.start()
+    return jobs
 
+# Finished audio is streamed from disk with range requests instead of through
+# st.audio(bytes), once KP_MEDIA_URL says how browsers reach the media server
+@st.cache_resource
+def get_media_server():
+    if not MEDIA_URL:
+        return None
     try:
-        segments = textwrap.wrap(text, width=500)
-        podcast_segments = []
-        
-        for i, segment in enumerate(segments[:6]):  # Limit to 6 segments
-            try:
-                # Configure voice and speed
-                if voices and len(voices) > 1:
-                    engine.setProperty('voice', voices[i % 2].id)
-                engine.setProperty('rate', 180 if i % 2 == 0 else 160)
-                
-                # Save to temporary WAV file
-                temp_wav = os.path.join(tempfile.gettempdir(), f"segment_{uuid4()}.wav")
-                engine.save_to_file(segment, temp_wav)
-                engine.runAndWait()
-                
-                # Read the generated WAV file
-                with open(temp_wav, "rb") as f:
-                    audio_data = f.read()
-                os.remove(temp_wav)
-                
-                podcast_segments.append(audio_data)
-                
-            except Exception as seg_error:
-                st.warning(f"Skipped segment {i}: {str(seg_error)}")
-                continue
-                
-        return b"".join(podcast_segments) if podcast_segments else None
-        
-    except Exception as e:
-        st.error(f"Podcast generation failed: {str(e)}")
+        return MediaServer(get_podcast_jobs().directory).start()
+    except OSError as e:
+        print(f"Media server not started, serving podcasts inline: {e}")
         return None
 
+def play_audio(path, mime, download_label=None):
+    """Audio player for a file under the podcast directory, with an optional download link."""
+    server = get_media_server()
+    if server is None:
+        with open(path, "rb") as f:
+            data = f.read()
+        st.audio(data, format=mime)
+        if download_label:
+            st.download_button(download_label, data, file_name=os.path.basename(path), mime=mime)
+        return
+    st.audio(server.url(path), format=mime)
+    if download_label:
+        st.markdown(f"[{download_label}]({server.url(path, download=True)})")
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}" if minutes >= 60 else f"{minutes}:{seconds:02d}"
+
+def show_chapters(jobs, job_id, chapters):
+    """List a podcast's chapters; finished chapters can be played right away."""
+    for chapter in chapters:
+        start = f"{format_duration(chapter['start'])} · " if chapter['start'] is not None else ""
+        label = f"{chapter['number']}. {chapter['title']} ({start}page {chapter['page']})"
+        if chapter.get('failed'):
+            st.markdown(f"- {label} — skipped, no audio could be generated")
+            continue
+        if not chapter['ready']:
+            st.markdown(f"- {label} — in progress")
+            continue
+        with st.expander(f"{label} — {format_duration(chapter['duration'])}"):
+            play_audio(os.path.join(jobs.job_dir(job_id), chapter['file']), chapter['mime'])
+
+def show_podcast_job(job_id):
+    """Show a podcast job's chapters, following it live until it finishes."""
+    store = get_metadata_store()
+    jobs = get_podcast_jobs()
+    job = store.get_podcast_job(job_id)
+    if job is None:
+        st.warning("Podcast not found. Upload the PDF again to create it.")
+        return
+
+    st.markdown(f"**{job['title']}**")
+    if job['status'] == JOB_FAILED:
+        st.error(f"Podcast generation failed: {job['error']}")
+        return
+
+    if job['status'] in PODCAST_ACTIVE_STATUSES:
+        progress = st.progress(0.0)
+        status = st.empty()
+        chapters = jobs.chapter_index(job_id)
+        show_chapters(jobs, job_id, chapters)
+        ready = sum(1 for chapter in chapters if chapter['ready'])
+        # Only this page waits; synthesis carries on if the user navigates away
+        while job['status'] in PODCAST_ACTIVE_STATUSES:
+            total = job['segments_total']
+            if total:
+                progress.progress(job['segments_done'] / total)
+                status.caption(
+                    f"{job['segments_done']} of {total} segments synthesized; "
+                    f"{ready} of {len(chapters)} chapters ready to play"
+                )
+            else:
+                status.caption("Waiting for a podcast worker..." if job['status'] == JOB_QUEUED else "Reading PDF...")
+            time.sleep(1)
+            job = store.get_podcast_job(job_id)
+            chapters = jobs.chapter_index(job_id)
+            if sum(1 for chapter in chapters if chapter['ready']) != ready:
+                # Show the newly finished chapter
+                st.experimental_rerun()
+        st.experimental_rerun()
+
+    if job['error']:
+        st.warning(job['error'])
+
+    path, mime = jobs.audio_file(job_id)
+    play_audio(path, mime, "Download Podcast")
+    st.caption(f"{os.path.getsize(path) / 1e6:.1f} MB ({mime})")
+    with open(jobs.chapters_path(job_id), "rb") as f:
+        st.download_button("Download Chapter Index", f.read(), file_name="chapters.json", mime="application/json")
+    st.caption(f"Share this podcast: add ?podcast={job_id} to the portal address")
+
+    st.markdown("#### Chapters")
+    show_chapters(jobs, job_id, jobs.chapter_index(job_id))
+
+    # Transcript preview
+    with st.expander("Transcript Preview"):
+        with open(jobs.transcript_path(job_id), encoding='utf-8') as f:
+            st.write(f.read(1000) + "...")
+
 def podcast_module():
     st.subheader("🎙️ PDF to Podcast")
     st.markdown("""
@@ -396,36 +577,20 @@ def podcast_module():
     
     uploaded_file = st.file_uploader("Upload PDF", type="pdf")
     
-    if uploaded_file and engine:
-        with st.spinner("Creating podcast..."):
-            try:
-                # Extract text
-                pdf = PdfReader(uploaded_file)
-                text = "\n".join([page.extract_text() for page in pdf.pages if page.extract_text()])
-                
-                if not text:
-                    st.error("No text found in PDF")
-                    return
-                
-                # Generate audio (first 5000 chars)
-                audio_data = generate_podcast(text[:5000])
-                
-                if audio_data:
-                    # Display and download
-                    st.audio(audio_data, format="audio/wav")
-                    st.download_button(
-                        "Download Podcast",
-                        audio_data,
-                        file_name="podcast.wav",
-                        mime="audio/wav"
-                    )
-                    
-                    # Transcript preview
-                    with st.expander("Transcript Preview"):
-                        st.write(text[:1000] + "...")
-                        
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+    if 'podcast_uploads' not in st.session_state:
+        st.session_state.podcast_uploads = {}
+    job_id = st.experimental_get_query_params().get('podcast', [None])[0]
+    if uploaded_file:
+        # Submit each upload once per session; the job id is the PDF's hash
+        upload_key = (uploaded_file.name, uploaded_file.size)
+        if upload_key not in st.session_state.podcast_uploads:
+            uploaded_file.seek(0)
+            st.session_state.podcast_uploads[upload_key] = get_podcast_jobs().submit(uploaded_file, uploaded_file.name)
+        job_id = st.session_state.podcast_uploads[upload_key]
+        st.experimental_set_query_params(podcast=job_id)
+
+    if job_id:
+        show_podcast_job(job_id)
 
 # Main app
 def main():
@@ -438,6 +603,8 @@ def main():
     load_css()
     init_session_state()
     
+    store = get_metadata_store()
+    
     st.title("🧠 Knowledge Continuity Portal")
     st.markdown("""
     <div style="color: #7f8c8d; font-size: 0.9em; margin-bottom: 20px;">
@@ -461,7 +628,7 @@ def main():
             st.markdown(f"""
             <div class="card">
                 <div class="card-header">Knowledge Repository</div>
-                <h2>{len(st.session_state.documents)}</h2>
+                <h2>{store.count_documents()}</h2>
                 <p>Documents stored</p>
             </div>
             """, unsafe_allow_html=True)
@@ -470,7 +637,7 @@ def main():
             st.markdown(f"""
             <div class="card">
                 <div class="card-header">Active Handovers</div>
-                <h2>{len([h for h in st.session_state.handovers if h['status'] == 'Draft'])}</h2>
+                <h2>{store.count_handovers(status='Draft')}</h2>
                 <p>In progress</p>
             </div>
             """, unsafe_allow_html=True)
@@ -479,7 +646,7 @@ def main():
             st.markdown(f"""
             <div class="card">
                 <div class="card-header">FAQ Knowledge</div>
-                <h2>{len(st.session_state.faqs)}</h2>
+                <h2>{store.count_faqs()}</h2>
                 <p>Questions answered</p>
             </div>
             """, unsafe_allow_html=True)
@@ -535,10 +702,9 @@ def main():
                     st.write(f"- Jira Interactions: {project['interactions']}")
 
         # Upcoming handovers alert
-        upcoming_handovers = [
-            h for h in st.session_state.handovers 
-            if datetime.datetime.strptime(h['last_working_day'], "%Y-%m-%d") - datetime.datetime.now() < datetime.timedelta(days=14)
-        ]
+        upcoming_handovers = store.handovers_due_by(
+            (datetime.datetime.now() + datetime.timedelta(days=14)).strftime("%Y-%m-%d")
+        )
         
         if upcoming_handovers:
             st.markdown("""
@@ -555,7 +721,7 @@ def main():
         
         # Recent documents
         st.subheader("Recently Added Documents")
-        recent_docs = sorted(st.session_state.documents, key=lambda x: x['upload_date'], reverse=True)[:5]
+        recent_docs = store.list_documents(limit=5)
         
         if recent_docs:
             for doc in recent_docs:
@@ -576,20 +742,26 @@ def main():
         with st.expander("Get recommendations for improving knowledge continuity"):
             query = st.text_input("What knowledge continuity challenges are you facing?")
             if query and st.button("Get Recommendations"):
-                with st.spinner("Analyzing with AI..."):
-                    recommendations = generate_ai_recommendations(query)
-                    st.markdown(f"""
-                    <div class="card">
-                        <div class="card-header">Recommendations</div>
-                        {recommendations.replace("\n", "<br>")}
-                    </div>
-                    """, unsafe_allow_html=True)
+                show_recommendations(query)
     
     # Knowledge Repository
     elif app_mode == "Knowledge Repository":
         st.subheader("📚 Knowledge Repository")
         st.info(f"Documents are saved in: `{os.path.abspath('documents')}`")
-        tab1, tab2 = st.tabs(["Browse Documents", "Upload New"])
+        if get_knowledge_index().status == "rebuilding":
+            st.warning("The search index is being rebuilt in the background. Results may be incomplete.")
+        cache_stats = get_knowledge_index().cache_stats()
+        if cache_stats:
+            st.caption(
+                f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                f"{cache_stats['entries']} cached chunks; {cache_stats.get('query_hits', 0)} repeat queries, "
+                f"{cache_stats['result_hits']} cached result pages served"
+            )
+        index_stats = get_knowledge_index().index_stats()
+        if index_stats['kind']:
+            quantization = f", {index_stats['quantization']}" if index_stats['quantization'] else ""
+            st.caption(f"Vector index: {index_stats['kind']}{quantization}, {index_stats['vectors']} chunks")
+        tab1, tab2, tab3 = st.tabs(["Browse Documents", "Upload New", "Bulk Import"])
         
         with tab1:
             st.markdown("""
@@ -598,38 +770,95 @@ def main():
             </div>
             """, unsafe_allow_html=True)
             
+            doc_type_filter = st.selectbox(
+                "Filter by document type",
+                ["All", "Project Documentation", "Code Snippet", "Best Practice", "Meeting Notes", "Other"]
+            )
+            with st.expander("More filters"):
+                filter_col1, filter_col2, filter_col3 = st.columns(3)
+                with filter_col1:
+                    tag_filter = st.multiselect(
+                        "Tags", ["Technical", "Process", "Client", "Internal", "Reference", "How-to"]
+                    )
+                with filter_col2:
+                    uploader_filter = st.multiselect("Uploaded by", store.list_uploaders())
+                with filter_col3:
+                    date_filter = st.date_input("Uploaded between", value=())
+            # Applied inside the search itself, so a selective filter still fills the page
+            filters = {
+                'type': [] if doc_type_filter == "All" else [doc_type_filter],
+                'tags': tag_filter,
+                'uploaded_by': uploader_filter,
+                'date_from': date_filter[0] if len(date_filter) > 0 else None,
+                'date_to': date_filter[1] if len(date_filter) > 1 else None,
+            }
+
             search_query = st.text_input("Search knowledge base")
+            search_col1, search_col2 = st.columns(2)
+            with search_col1:
+                search_mode = st.radio(
+                    "Search mode", ["hybrid", "keyword", "semantic"], horizontal=True,
+                    help="Keyword matches exact terms such as ticket keys and error codes; semantic matches meaning"
+                )
+            with search_col2:
+                page_size = st.number_input("Results per page", min_value=1, max_value=50, value=3)
+            search_key = (search_query, search_mode, page_size, repr(sorted(filters.items())))
+            if st.session_state.get('search_key') != search_key:
+                st.session_state.search_key = search_key
+                st.session_state.search_page = 0
             if search_query:
                 st.markdown("### Search Results")
-                docs = search_knowledge_base(search_query)
-                if docs:
-                    for doc in docs:
+                results, has_more = search_knowledge_base(
+                    search_query, k=int(page_size), page=st.session_state.search_page, mode=search_mode,
+                    filters=filters
+                )
+                if results:
+                    for result in results:
+                        chunks_html = "".join([
+                            f"<p>{chunk.page_content[:200]}...<br><small>Page {chunk.metadata['page']}</small></p>"
+                            if chunk.metadata['page'] else f"<p>{chunk.page_content[:200]}...</p>"
+                            for chunk in result['chunks']
+                        ])
                         st.markdown(f"""
                         <div class="document-item">
-                            <h4>{doc.metadata['source']}</h4>
-                            <p>{doc.page_content[:200]}...</p>
-                            <small>Type: {doc.metadata['type']}</small>
+                            <h4>{result['source']}</h4>
+                            {chunks_html}
+                            <small>Type: {result['type']}</small>
                         </div>
                         """, unsafe_allow_html=True)
                 else:
                     st.info("No matching documents found")
+                
+                prev_col, page_col, next_col = st.columns([1, 2, 1])
+                with prev_col:
+                    if st.session_state.search_page > 0 and st.button("← Previous"):
+                        st.session_state.search_page -= 1
+                        st.experimental_rerun()
+                with page_col:
+                    st.caption(f"Page {st.session_state.search_page + 1}")
+                with next_col:
+                    if has_more and st.button("Next →"):
+                        st.session_state.search_page += 1
+                        st.experimental_rerun()
             
-            doc_type_filter = st.selectbox(
-                "Filter by document type",
-                ["All", "Project Documentation", "Code Snippet", "Best Practice", "Meeting Notes", "Other"]
-            )
-            
-            filtered_docs = get_documents_by_type() if doc_type_filter == "All" else get_documents_by_type(doc_type_filter)
+            filtered_docs = get_filtered_documents(filters)
+            jobs = store.ingestion_statuses([doc['id'] for doc in filtered_docs])
             
             if filtered_docs:
                 for doc in filtered_docs:
                     with st.expander(f"{doc['title']} - {doc['type']}"):
                         tags_html = " ".join([f'<span class="tag tag-primary">{tag}</span>' for tag in doc["tags"]])
+                        job = jobs.get(doc['id'])
+                        status = job['status'] if job else JOB_INDEXED
+                        status_color = {JOB_INDEXED: "tag-success", JOB_FAILED: "tag-danger"}.get(status, "tag-warning")
                         st.markdown(f"""
                         <p><strong>Description:</strong> {doc['description']}</p>
                         <p><strong>Tags:</strong> {tags_html}</p>
                         <p><strong>Uploaded:</strong> {doc['upload_date']} by {doc['uploaded_by']}</p>
+                        <p><strong>Search index:</strong> <span class="tag {status_color}">{status}</span></p>
                         """, unsafe_allow_html=True)
+                        if job and job['error']:
+                            st.caption(job['error'])
                         
                         with open(doc['file_path'], "rb") as f:
                             st.download_button(
@@ -638,6 +867,10 @@ def main():
                                 file_name=os.path.basename(doc['file_path']),
                                 mime="application/octet-stream"
                             )
+
+                        if st.button("Delete Document", key=f"delete_doc_{doc['id']}"):
+                            delete_document(doc['id'])
+                            st.experimental_rerun()
             else:
                 st.info("No documents found matching your criteria")
         
@@ -656,12 +889,67 @@ def main():
                     "Document Type",
                     ["Project Documentation", "Code Snippet", "Best Practice", "Meeting Notes", "Other"]
                 )
+                replace_existing = st.checkbox("Replace existing document with the same title")
                 
                 submitted = st.form_submit_button("Upload Document")
                 if submitted and file and title:
-                    document = save_document(file, title, description, tags, doc_type)
-                    st.success(f"Document '{title}' uploaded successfully!")
+                    document = save_document(file, title, description, tags, doc_type, replace_existing)
+                    st.success(f"Document '{title}' uploaded successfully! It will be searchable once indexed.")
                     st.balloons()
+
+            active_jobs = store.active_ingestion_jobs()
+            if active_jobs:
+                st.markdown("### Ingestion Queue")
+                for job in active_jobs:
+                    st.markdown(f"- **{job['title']}** — {job['status']} (since {job['updated_at'][:19]})")
+                st.button("Refresh status")
+
+        with tab3:
+            st.markdown("### Bulk Import")
+            st.markdown("Import a whole folder on the server, or a zip archive, in batches. "
+                        "Re-running an interrupted import skips what is already indexed.")
+            with st.form("bulk_import_form"):
+                folder = st.text_input("Server folder path")
+                archive = st.file_uploader("...or upload a zip archive", type=["zip"])
+                bulk_tags = st.multiselect(
+                    "Tags",
+                    ["Technical", "Process", "Client", "Internal", "Reference", "How-to"],
+                    default=["Reference"]
+                )
+                bulk_type = st.selectbox(
+                    "Document Type",
+                    ["Project Documentation", "Code Snippet", "Best Practice", "Meeting Notes", "Other"],
+                    index=4
+                )
+                submitted = st.form_submit_button("Start Import")
+                if submitted and archive:
+                    archive_path = os.path.join(tempfile.gettempdir(), f"bulk_{uuid4()}.zip")
+                    with open(archive_path, "wb") as f:
+                        shutil.copyfileobj(archive, f, 1024 * 1024)
+                    start_bulk_import(
+                        archive_path, bulk_type, bulk_tags,
+                        source_name=f"zip:{archive.name}:{archive.size}", remove_source=True
+                    )
+                    st.success(f"Import of '{archive.name}' started")
+                elif submitted and folder:
+                    if os.path.isdir(folder):
+                        start_bulk_import(folder, bulk_type, bulk_tags)
+                        st.success(f"Import of '{folder}' started")
+                    else:
+                        st.error(f"Folder not found: {folder}")
+
+            bulk_imports = get_bulk_imports()
+            if bulk_imports:
+                for entry in bulk_imports.values():
+                    progress = entry["importer"].progress
+                    st.markdown(
+                        f"- **{entry['source']}** — {progress['status']}: {progress['seen']} seen, "
+                        f"{progress['imported']} imported, {progress['skipped']} skipped, {progress['failed']} failed "
+                        f"({progress['docs_per_minute']:.1f} docs/min)"
+                    )
+                    if progress['error']:
+                        st.caption(progress['error'])
+                st.button("Refresh progress")
     
     # Handover Manager
     elif app_mode == "Handover Manager":
@@ -676,8 +964,9 @@ def main():
             </div>
             """, unsafe_allow_html=True)
             
-            if st.session_state.handovers:
-                for handover in st.session_state.handovers:
+            handovers = store.list_handovers()
+            if handovers:
+                for handover in handovers:
                     status_color = "tag-success" if handover['status'] == "Completed" else "tag-warning"
                     
                     with st.expander(f"{handover['employee_name']} - {handover['last_working_day']}"):
@@ -714,6 +1003,7 @@ def main():
 
                             submitted = st.form_submit_button("Update Handover")
                             if submitted:
+                                store.save_handover(handover)
                                 st.success("Handover updated successfully!")
 
                         # ✅ Generate and download PDF *outside* the form
@@ -780,12 +1070,7 @@ def main():
             """, unsafe_allow_html=True)
             
             search_query = st.text_input("Search FAQs")
-            filtered_faqs = [
-                faq for faq in st.session_state.faqs 
-                if not search_query or 
-                   search_query.lower() in faq['question'].lower() or 
-                   search_query.lower() in faq['answer'].lower()
-            ]
+            filtered_faqs = search_faqs(search_query)
             
             if filtered_faqs:
                 for faq in filtered_faqs:
@@ -800,7 +1085,7 @@ def main():
                         col1, col2 = st.columns(2)
                         with col1:
                             if st.button(f"👍 Upvote ({faq['upvotes']})", key=f"upvote_{faq['id']}"):
-                                faq['upvotes'] += 1
+                                upvote_faq(faq)
                                 st.experimental_rerun()
             else:
                 st.info("No FAQs found matching your criteria")
@@ -818,9 +1103,43 @@ def main():
                 
                 submitted = st.form_submit_button("Add FAQ")
                 if submitted and question and answer:
-                    faq = add_faq(question, answer, tags)
-                    st.success("FAQ added successfully!")
-                    st.balloons()
+                    similar = find_similar_faqs(question)
+                    if similar and similar[0][1] >= FAQ_DUPLICATE_THRESHOLD:
+                        # Held back until the user picks merge or add below
+                        st.session_state.pending_faq = {
+                            'question': question, 'answer': answer, 'tags': tags, 'similar': similar,
+                        }
+                    else:
+                        add_faq(question, answer, tags)
+                        st.success("FAQ added successfully!")
+                        st.balloons()
+                        if similar:
+                            st.markdown("**Related questions already answered:**")
+                            for faq, score in similar:
+                                st.markdown(f"- {faq['question']} ({score:.0%} similar)")
+
+            pending = st.session_state.get('pending_faq')
+            if pending:
+                st.warning("This question looks like one that is already answered. Merge your answer into it, or add it anyway.")
+                for faq, score in pending['similar']:
+                    if score < FAQ_DUPLICATE_THRESHOLD:
+                        continue
+                    st.markdown(f"**{faq['question']}** ({score:.0%} similar)")
+                    st.markdown(faq['answer'])
+                    if st.button("Merge into this FAQ", key=f"merge_{faq['id']}"):
+                        merge_faq(faq, pending['answer'], pending['tags'])
+                        del st.session_state.pending_faq
+                        st.success("Answer merged into the existing FAQ")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("Add as new FAQ", key="add_pending_faq"):
+                        add_faq(pending['question'], pending['answer'], pending['tags'])
+                        del st.session_state.pending_faq
+                        st.success("FAQ added successfully!")
+                with col2:
+                    if st.button("Discard", key="discard_pending_faq"):
+                        del st.session_state.pending_faq
+                        st.experimental_rerun()
     
     # AI Recommendations
     elif app_mode == "AI Recommendations":
@@ -837,63 +1156,48 @@ def main():
             submit = st.form_submit_button("Get Recommendations")
             
             if submit and context:
-                with st.spinner("Analyzing with AI..."):
-                    recommendations = generate_ai_recommendations(context)
-                    st.markdown(f"""
-                    <div class="card">
-                        <div class="card-header">Recommendations</div>
-                        {recommendations.replace("\n", "<br>")}
-                    </div>
-                    """, unsafe_allow_html=True)
+                show_recommendations(context)
         
         st.markdown("### Common Scenarios")
+        llm_stats = get_llm_backend().stats()
+        st.caption(
+            f"Response cache: {llm_stats['hits']} hits, {llm_stats['misses']} misses, "
+            f"{llm_stats['entries']} cached answers; {llm_stats['coalesced']} duplicate requests coalesced"
+        )
+        if 'client' in llm_stats:
+            client_stats = llm_stats['client']
+            st.caption(
+                f"LLM server: {client_stats['requests']} requests, {client_stats['active']} in progress, "
+                f"{client_stats['retries']} retries, {client_stats['rejected']} rejected; "
+                f"circuit {client_stats['breaker']}"
+            )
         col1, col2 = st.columns(2)
         
         with col1:
             if st.button("New Team Member Onboarding"):
-                recommendations = generate_ai_recommendations(
-                    "What are best practices for onboarding new team members to ensure knowledge transfer?"
+                show_recommendations(
+                    "What are best practices for onboarding new team members to ensure knowledge transfer?",
+                    "Onboarding Recommendations"
                 )
-                st.markdown(f"""
-                <div class="card">
-                    <div class="card-header">Onboarding Recommendations</div>
-                    {recommendations.replace("\n", "<br>")}
-                </div>
-                """, unsafe_allow_html=True)
             
             if st.button("Critical Employee Leaving"):
-                recommendations = generate_ai_recommendations(
-                    "How to handle knowledge transfer when a critical employee is leaving the organization?"
+                show_recommendations(
+                    "How to handle knowledge transfer when a critical employee is leaving the organization?",
+                    "Knowledge Transfer Recommendations"
                 )
-                st.markdown(f"""
-                <div class="card">
-                    <div class="card-header">Knowledge Transfer Recommendations</div>
-                    {recommendations.replace("\n", "<br>")}
-                </div>
-                """, unsafe_allow_html=True)
         
         with col2:
             if st.button("Project Documentation Gaps"):
-                recommendations = generate_ai_recommendations(
-                    "Our project documentation is incomplete. What strategies can we use to improve documentation quality?"
+                show_recommendations(
+                    "Our project documentation is incomplete. What strategies can we use to improve documentation quality?",
+                    "Documentation Recommendations"
                 )
-                st.markdown(f"""
-                <div class="card">
-                    <div class="card-header">Documentation Recommendations</div>
-                    {recommendations.replace("\n", "<br>")}
-                </div>  
-                """, unsafe_allow_html=True)
             
             if st.button("Improving Team Knowledge Sharing"):
-                recommendations = generate_ai_recommendations(
-                    "Our team doesn't share knowledge effectively. What processes can we implement to improve?"
+                show_recommendations(
+                    "Our team doesn't share knowledge effectively. What processes can we implement to improve?",
+                    "Knowledge Sharing Recommendations"
                 )
-                st.markdown(f"""
-                <div class="card">
-                    <div class="card-header">Knowledge Sharing Recommendations</div>
-                    {recommendations.replace("\n", "<br>")}
-                </div>
-                """, unsafe_allow_html=True)
     
     #Podcast
     elif app_mode == "Podcast Generator":
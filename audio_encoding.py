@@ -0,0 +1,168 @@
+"""Compressed encodings for podcast audio.
+
+Ogg/Opus or MP3 are produced through whichever local encoder is available
+(ffmpeg, opusenc, lame, or the lameenc package), fed straight from the
+streaming WAV assembly. Without any of them, the audio is written as
+G.711 mu-law WAV in pure Python. That is coarser and only about four to
+six times smaller than PCM, but every browser can play it.
+"""
+import os
+import shutil
+import struct
+import subprocess
+
+import numpy as np
+
+from wav_audio import iter_wav, wav_format
+
+# opus, mp3 or mulaw; the first available encoder for it is used, then the others
+PODCAST_AUDIO_FORMAT = os.environ.get("KP_PODCAST_FORMAT", "opus")
+# Speech stays clear at 24-48 kbps with Opus, 32-64 kbps with MP3
+PODCAST_BITRATE_KBPS = int(os.environ.get("KP_PODCAST_BITRATE", "32"))
+
+MIME_TYPES = {'opus': "audio/ogg", 'mp3': "audio/mpeg", 'mulaw': "audio/wav"}
+EXTENSIONS = {'opus': ".ogg", 'mp3': ".mp3", 'mulaw': ".ulaw.wav"}
+# mu-law stores one byte per sample, so the bitrate sets the sample rate
+MULAW_MIN_RATE = 8000
+MULAW_MAX_RATE = 22050
+
+
+class EncoderUnavailable(Exception):
+    pass
+
+
+def mulaw_encode(samples):
+    """16-bit PCM samples (int16 array) -> G.711 mu-law bytes."""
+    # The reference algorithm on 14-bit values, as in audioop.lin2ulaw
+    values = samples.astype(np.int32) >> 2
+    mask = np.where(values < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(values), 8159) + 33
+    segment = np.floor(np.log2(magnitude)).astype(np.int32) - 5
+    mantissa = np.where(segment > 7, 0x0F, (magnitude >> (np.minimum(segment, 7) + 1)) & 0x0F)
+    return (((np.minimum(segment, 7) << 4) | mantissa) ^ mask).astype(np.uint8).tobytes()
+
+
+def mulaw_header(frames, rate):
+    """WAV header for mono mu-law: fmt with format tag 7, plus the fact chunk non-PCM formats need."""
+    return struct.pack(
+        "<4sI4s4sIHHIIHHH4sII4sI",
+        b"RIFF", 4 + 26 + 12 + 8 + frames, b"WAVE",
+        b"fmt ", 18, 7, 1, rate, rate, 1, 8, 0,
+        b"fact", 4, frames,
+        b"data", frames,
+    )
+
+
+def _pcm_chunks(paths, channels, rate):
+    """16-bit PCM frames (after the header) of the assembled WAV stream."""
+    chunks = iter_wav(paths, channels=channels, sample_width=2, rate=rate)
+    header = next(chunks)
+    return int.from_bytes(header[40:44], "little") // (2 * channels), chunks
+
+
+def encode_mulaw(paths, out, kbps):
+    rate = min(MULAW_MAX_RATE, max(MULAW_MIN_RATE, kbps * 1000 // 8))
+    frames, chunks = _pcm_chunks(paths, 1, rate)
+    out.write(mulaw_header(frames, rate))
+    for data in chunks:
+        out.write(mulaw_encode(np.frombuffer(data, dtype="<i2")))
+
+
+def encode_lameenc(paths, out, kbps):
+    try:
+        import lameenc
+    except ImportError as e:
+        raise EncoderUnavailable("lameenc is not installed") from e
+
+    rate = wav_format(paths[0])[2]
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(kbps)
+    encoder.set_in_sample_rate(rate)
+    encoder.set_channels(1)
+    encoder.set_quality(2)
+    frames, chunks = _pcm_chunks(paths, 1, rate)
+    for data in chunks:
+        out.write(encoder.encode(data))
+    out.write(encoder.flush())
+
+
+def _command(name, kbps, path):
+    ffmpeg = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "wav", "-i", "pipe:0", "-ac", "1"]
+    return {
+        'ffmpeg-opus': ffmpeg + ["-c:a", "libopus", "-b:a", f"{kbps}k", "-application", "voip", "-f", "ogg", path],
+        'ffmpeg-mp3': ffmpeg + ["-c:a", "libmp3lame", "-b:a", f"{kbps}k", "-f", "mp3", path],
+        'opusenc': ["opusenc", "--quiet", "--bitrate", str(kbps), "-", path],
+        'lame': ["lame", "--quiet", "-m", "m", "-b", str(kbps), "-", path],
+    }[name]
+
+
+def encode_external(name, paths, path, kbps):
+    """Pipe the assembled WAV stream into a command-line encoder writing path."""
+    command = _command(name, kbps, path)
+    if shutil.which(command[0]) is None:
+        raise EncoderUnavailable(f"{command[0]} not found")
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        for data in iter_wav(paths):
+            process.stdin.write(data)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    finally:
+        errors = process.stderr.read().decode('utf-8', 'replace').strip()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"{name} failed: {errors or process.returncode}")
+
+
+# Encoders in order of preference for each format
+ENCODERS = {
+    'opus': ("ffmpeg-opus", "opusenc"),
+    'mp3': ("ffmpeg-mp3", "lame", "lameenc"),
+    'mulaw': ("mulaw",),
+}
+ENCODER_FORMATS = {name: audio_format for audio_format, names in ENCODERS.items() for name in names}
+
+
+def encoder_order(audio_format=PODCAST_AUDIO_FORMAT):
+    """The wanted format's encoders, then the other compressed format's, then the pure-Python one."""
+    formats = [audio_format] + [other for other in ("opus", "mp3") if other != audio_format] + ["mulaw"]
+    return [name for fmt in dict.fromkeys(formats) for name in ENCODERS[fmt]]
+
+
+def find_encoded(base_path):
+    """(path, mime_type) of an earlier encoding of base_path, or None."""
+    for audio_format, extension in EXTENSIONS.items():
+        if os.path.exists(base_path + extension):
+            return base_path + extension, MIME_TYPES[audio_format]
+    return None
+
+
+def encode_audio(paths, base_path, audio_format=PODCAST_AUDIO_FORMAT, kbps=PODCAST_BITRATE_KBPS):
+    """Encode the WAV files in paths, joined in order, next to base_path.
+
+    Returns (path, mime_type, encoder). The output gets the extension of
+    whichever format the first working encoder produces.
+    """
+    failures = []
+    for name in encoder_order(audio_format):
+        path = base_path + EXTENSIONS[ENCODER_FORMATS[name]]
+        partial = path + ".part"
+        try:
+            if name == "mulaw":
+                with open(partial, "wb") as out:
+                    encode_mulaw(paths, out, kbps)
+            elif name == "lameenc":
+                with open(partial, "wb") as out:
+                    encode_lameenc(paths, out, kbps)
+            else:
+                encode_external(name, paths, partial, kbps)
+        except Exception as e:
+            if not isinstance(e, EncoderUnavailable):
+                failures.append(str(e))
+            if os.path.exists(partial):
+                os.remove(partial)
+            continue
+        os.replace(partial, path)
+        return path, MIME_TYPES[ENCODER_FORMATS[name]], name
+    raise RuntimeError("No audio encoder worked: " + "; ".join(failures))
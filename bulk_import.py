@@ -0,0 +1,185 @@
+"""Bulk import of a folder or zip archive into the knowledge repository.
+
+    python bulk_import.py /mnt/share/handbook --type "Project Documentation" --tags Reference
+
+Run the CLI while the portal is stopped; while it is running use the
+"Bulk Import" tab instead, so the import goes through the app's shared index.
+"""
+import argparse
+import contextlib
+import datetime
+import os
+import shutil
+import time
+import zipfile
+from uuid import NAMESPACE_URL, uuid5
+
+from ingestion import iter_document_segments
+from metadata_store import JOB_INDEXED
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md", ".docx")
+BULK_IMPORT_BATCH_SIZE = 32
+DOCUMENTS_DIR = "documents"
+
+
+def iter_import_sources(source, stack):
+    """Yield (name, size, open_file) for every supported file in a folder or zip.
+
+    A zip archive stays open until the given ExitStack is closed.
+    """
+    if zipfile.is_zipfile(source):
+        archive = stack.enter_context(zipfile.ZipFile(source))
+        for info in sorted(archive.infolist(), key=lambda info: info.filename):
+            if not info.is_dir() and info.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield info.filename, info.file_size, lambda info=info: archive.open(info)
+        return
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, source), os.path.getsize(path), lambda path=path: open(path, "rb")
+
+
+class BulkImporter:
+    """Streams files through extraction and batched embedding.
+
+    Text is read page by page (large PDFs across the extraction pool) straight
+    into chunking, as for uploads, so no file is held in memory whole. Each
+    batch is written to the metadata store and committed to the vector
+    index in one go. Document ids are derived from the source and file name,
+    so re-running an interrupted import skips everything already indexed.
+    """
+
+    def __init__(self, store, index, doc_type="Other", tags=None, uploaded_by="Bulk Import",
+                 batch_size=BULK_IMPORT_BATCH_SIZE):
+        self.store = store
+        self.index = index
+        self.doc_type = doc_type
+        self.tags = tags or ["Reference"]
+        self.uploaded_by = uploaded_by
+        self.batch_size = batch_size
+        self.progress = {
+            'status': "pending", 'seen': 0, 'imported': 0, 'skipped': 0, 'failed': 0,
+            'elapsed': 0.0, 'docs_per_minute': 0.0, 'error': None,
+        }
+
+    def _document_id(self, source_name, name, size):
+        return str(uuid5(NAMESPACE_URL, f"{source_name}|{name}|{size}"))
+
+    def _copy(self, doc_id, name, open_file):
+        os.makedirs(DOCUMENTS_DIR, exist_ok=True)
+        file_path = os.path.join(DOCUMENTS_DIR, f"{doc_id}_{os.path.basename(name)}")
+        with open_file() as src, open(file_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return file_path
+
+    def _stage(self, source_name, entries):
+        """Copy a batch into documents/ and return its document records."""
+        documents = []
+        for name, size, open_file in entries:
+            doc_id = self._document_id(source_name, name, size)
+            if self.store.get_document(doc_id) is not None and doc_id in self.index:
+                self.progress['skipped'] += 1
+                continue
+            try:
+                file_path = self._copy(doc_id, name, open_file)
+            except OSError:
+                self.progress['failed'] += 1
+                continue
+            documents.append({
+                "id": doc_id,
+                "title": os.path.splitext(os.path.basename(name))[0],
+                "description": f"Imported from {name}",
+                "tags": self.tags,
+                "type": self.doc_type,
+                "file_path": file_path,
+                "upload_date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "uploaded_by": self.uploaded_by,
+            })
+        return documents
+
+    def _commit(self, documents):
+        if not documents:
+            return
+        self.store.save_documents(documents)
+        errors = {}
+        for document in documents:
+            errors[document['id']] = []
+            # Read lazily while the batch is embedded; unreadable files fall back to their description
+            document['segments'] = iter_document_segments(document, errors[document['id']])
+        self.index.add_documents(documents)
+        for doc_id, failures in errors.items():
+            warning = f"Text extraction failed, indexed what could be read: {failures[0]}" if failures else None
+            self.store.record_ingestion([doc_id], JOB_INDEXED, warning)
+        self.progress['imported'] += len(documents)
+
+    def run(self, source, on_progress=None, source_name=None):
+        """Import everything under source.
+
+        source_name identifies the import for restarts; it defaults to the
+        absolute path and should be set when source is a temporary copy.
+        """
+        source_name = source_name or os.path.abspath(source)
+        # A background rebuild would reset the index underneath the import
+        while self.index.status == "rebuilding":
+            time.sleep(1)
+        self.progress['status'] = "running"
+        started = time.monotonic()
+        batch = []
+        try:
+            with contextlib.ExitStack() as stack:
+                for entry in iter_import_sources(source, stack):
+                    self.progress['seen'] += 1
+                    batch.append(entry)
+                    if len(batch) == self.batch_size:
+                        self._commit(self._stage(source_name, batch))
+                        batch = []
+                        self._report(started, on_progress)
+                self._commit(self._stage(source_name, batch))
+            self.progress['status'] = "done"
+        except Exception as e:
+            self.progress['status'] = "failed"
+            self.progress['error'] = str(e)
+            raise
+        finally:
+            self._report(started, on_progress)
+        return self.progress
+
+    def _report(self, started, on_progress):
+        elapsed = time.monotonic() - started
+        self.progress['elapsed'] = elapsed
+        self.progress['docs_per_minute'] = self.progress['imported'] / elapsed * 60 if elapsed else 0.0
+        if on_progress:
+            on_progress(self.progress)
+
+
+def main():
+    from knowledge_index import INDEX_DIR, KnowledgeIndex
+    from metadata_store import MetadataStore
+
+    parser = argparse.ArgumentParser(description="Import a folder or zip archive into the Knowledge Portal.")
+    parser.add_argument("source", help="directory or .zip file to import")
+    parser.add_argument("--type", default="Other", help="document type for every imported file")
+    parser.add_argument("--tags", nargs="*", default=["Reference"], help="tags for every imported file")
+    parser.add_argument("--batch-size", type=int, default=BULK_IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    index = KnowledgeIndex(index_dir=INDEX_DIR)
+    index.load()
+    importer = BulkImporter(MetadataStore(), index, doc_type=args.type, tags=args.tags, batch_size=args.batch_size)
+
+    def report(progress):
+        print(
+            f"{progress['seen']} seen, {progress['imported']} imported, {progress['skipped']} skipped, "
+            f"{progress['failed']} failed - {progress['docs_per_minute']:.1f} docs/min"
+        )
+
+    try:
+        importer.run(args.source, on_progress=report)
+    finally:
+        index.compact()
+
+
+if __name__ == "__main__":
+    main()
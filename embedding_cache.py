@@ -0,0 +1,164 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain.embeddings.base import Embeddings
+
+EMBEDDING_CACHE_PATH = "embedding_cache.db"
+# Roughly 1.5KB per MiniLM-L3 vector, so ~300MB on disk at the default bound
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+# Query vectors kept in memory; Streamlit reruns repeat the same query often
+QUERY_CACHE_SIZE = 256
+
+
+class LRUCache:
+    """Small thread-safe in-memory LRU map."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class EmbeddingCache:
+    """Persistent LRU cache of embedding vectors.
+
+    Keys are a hash of the model name and the exact text, so any app or
+    index using the same model shares the entries.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys that are cached."""
+        found = {}
+        conn = self._connect()
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for key, blob in conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ):
+                found[key] = array('f', blob).tolist()
+        if found:
+            with conn:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in found],
+                )
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs and evict the least recently used overflow."""
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array('f', vector).tobytes(), now) for key, vector in items],
+            )
+            overflow = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+
+    def stats(self):
+        entries = self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model so document texts are only embedded once.
+
+    Query vectors are kept in a per-process LRU instead of the persistent
+    cache, so ad-hoc searches do not evict document vectors.
+    """
+
+    def __init__(self, embeddings, cache, model_name, query_cache_size=QUERY_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.queries = LRUCache(query_cache_size)
+
+    def embed_documents(self, texts):
+        keys = [EmbeddingCache.key(self.model_name, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed.items())
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        vector = self.queries.get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.queries.put(text, vector)
+        return vector
@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+
+from metadata_store import JOB_EMBEDDING, JOB_FAILED, JOB_INDEXED
+
+INGESTION_WORKERS = 2
+# Characters read per block when streaming plain text files
+TEXT_BLOCK_SIZE = 64 * 1024
+# Pages handed to one extraction process at a time
+PDF_PAGES_PER_TASK = 16
+# Below this many pages, process start-up and pickling cost more than they save
+PDF_PARALLEL_MIN_PAGES = 32
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_pool():
+    """Process pool shared by every PDF extraction in this process."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn, not fork: the Streamlit server is multi-threaded
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+
+def extract_page_range(file_path, start, stop):
+    """Runs in a worker process; extract_text is called once per page."""
+    reader = PdfReader(file_path)
+    return [reader.pages[number].extract_text() or "" for number in range(start, stop)]
+
+
+def iter_pdf_pages(file_path, pages_per_task=PDF_PAGES_PER_TASK):
+    """Yield the text of every page of a PDF, in order.
+
+    Large PDFs are split into page ranges that are extracted in parallel
+    across the process pool; each range is yielded as soon as it and all
+    ranges before it are done.
+    """
+    page_count = len(PdfReader(file_path).pages)
+    if page_count < PDF_PARALLEL_MIN_PAGES or (os.cpu_count() or 1) == 1:
+        yield from extract_page_range(file_path, 0, page_count)
+        return
+
+    pool = get_pdf_pool()
+    futures = [
+        pool.submit(extract_page_range, file_path, start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        # Abandoned generators should not leave the pool busy
+        for future in futures:
+            future.cancel()
+
+
+def iter_text(file_path):
+    """Stream a stored upload as (page, text) segments.
+
+    PDFs yield one segment per page (1-based); text files yield fixed-size
+    blocks with page None. Unsupported formats yield nothing.
+    """
+    if file_path.endswith('.txt'):
+        with open(file_path, "r", encoding='utf-8') as f:
+            for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ""):
+                yield None, block
+    elif file_path.endswith('.pdf'):
+        for page_number, page_text in enumerate(iter_pdf_pages(file_path), start=1):
+            yield page_number, page_text
+
+
+def iter_document_segments(document, errors=None):
+    """Segments for a document record, falling back to its description.
+
+    Extraction errors are appended to errors (when given) instead of raised,
+    so whatever was read before the failure is still indexed.
+    """
+    produced = False
+    try:
+        if document.get('file_path'):
+            for page, text in iter_text(document['file_path']):
+                if text:
+                    produced = True
+                    yield page, text
+    except Exception as e:
+        if errors is not None:
+            errors.append(str(e))
+    if not produced:
+        yield None, document.get('description') or document['title']
+
+
+class IngestionWorkers:
+    """Background threads that extract, chunk and embed queued uploads.
+
+    Jobs live in the metadata store, so anything still queued or in flight
+    when the process stops is picked up again on the next start.
+    """
+
+    def __init__(self, store, index, workers=INGESTION_WORKERS, poll_interval=1.0):
+        self.store = store
+        self.index = index
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        # Assumes one worker pool per database: jobs claimed by a previous
+        # run of this process were interrupted, not running elsewhere
+        self.store.requeue_interrupted_jobs()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"ingestion-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, doc_id):
+        self.store.enqueue_ingestion(doc_id)
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.store.claim_ingestion_job()
+            if job is None:
+                # Other processes can enqueue too, so poll as well as wait
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self.process(*job)
+            except Exception as e:
+                self.store.set_ingestion_status(job[0], JOB_FAILED, str(e), enqueued_at=job[1])
+
+    def process(self, doc_id, enqueued_at):
+        document = self.store.get_document(doc_id)
+        if document is None:
+            return
+
+        # Extraction is streamed straight into chunking and embedding, so the
+        # job moves to embedding as soon as the first segment is read
+        errors = []
+        segments = iter_document_segments(document, errors)
+
+        def reading():
+            first = True
+            for segment in segments:
+                if first:
+                    self.store.set_ingestion_status(doc_id, JOB_EMBEDDING, enqueued_at=enqueued_at)
+                    first = False
+                yield segment
+
+        document['segments'] = reading()
+        self.index.add_document(document)
+        warning = f"Text extraction failed, indexed what could be read: {errors[0]}" if errors else None
+
+        if self.store.get_document(doc_id) is None:
+            # Deleted while we were embedding it
+            self.index.remove_document(doc_id)
+            return
+        self.store.set_ingestion_status(doc_id, JOB_INDEXED, warning, enqueued_at=enqueued_at)
@@ -0,0 +1,180 @@
+import bisect
+import math
+import re
+import threading
+from collections import Counter
+
+# Identifiers such as PROJ-102, ERR_CONN_42 or v1.2.3 stay one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+(?:[-.][a-z0-9_]+)*")
+# Standard BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """Lower-cased tokens; compound identifiers also yield their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if "-" in token or "." in token:
+            tokens.extend(part for part in re.split(r"[-.]", token) if part)
+    return tokens
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring over chunks, keyed by vector id.
+
+    Not thread-safe on its own; KnowledgeIndex guards it with its
+    reader/writer lock.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = {}
+        # Terms of every chunk, so removal only touches its own posting lists
+        self.chunk_terms = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, key, term_counts):
+        """Index a chunk given its Counter of tokens (see tokenize)."""
+        if key in self.lengths:
+            self.remove(key)
+        for term, count in term_counts.items():
+            self.postings.setdefault(term, {})[key] = count
+        length = sum(term_counts.values())
+        self.chunk_terms[key] = tuple(term_counts)
+        self.lengths[key] = length
+        self.total_length += length
+
+    def remove(self, key):
+        length = self.lengths.pop(key, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.chunk_terms.pop(key):
+            posting = self.postings[term]
+            del posting[key]
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query, k=10, allowed=None):
+        """Return the k best (key, score) pairs for a query.
+
+        allowed, if given, is a predicate on keys; other chunks are skipped
+        while scoring, so a filter never shrinks the result below k.
+        """
+        if not self.lengths:
+            return []
+        n = len(self.lengths)
+        average_length = self.total_length / n
+        scores = Counter()
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for key, count in posting.items():
+                if allowed is not None and not allowed(key):
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average_length)
+                scores[key] += idf * count * (self.k1 + 1) / (count + norm)
+        return scores.most_common(k)
+
+
+# Field weights for FAQ matches: a hit in the question counts most
+FAQ_FIELD_WEIGHTS = {'question': 3, 'tags': 2, 'answer': 1}
+# Shorter query tokens only match whole terms, to keep prefix expansion small
+FAQ_MIN_PREFIX = 2
+
+
+class FaqSearchIndex:
+    """Inverted index over FAQ questions, answers and tags.
+
+    Every query token matches terms that start with it, so results update
+    as the user types; all tokens must match. Results are ranked by field
+    weight, then upvotes, then views. Updated incrementally as FAQs are
+    added or voted on, so a search never scans the FAQ texts.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        # Sorted vocabulary for prefix lookups
+        self.terms = []
+        self.faq_terms = {}
+        self.popularity = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.faq_terms)
+
+    def add(self, faq):
+        weights = Counter()
+        for field, weight in FAQ_FIELD_WEIGHTS.items():
+            value = " ".join(faq[field]) if field == 'tags' else faq[field]
+            for term in set(tokenize(value)):
+                weights[term] += weight
+        with self._lock:
+            self._remove_locked(faq['id'])
+            for term, weight in weights.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = {}
+                    bisect.insort(self.terms, term)
+                posting[faq['id']] = weight
+            self.faq_terms[faq['id']] = tuple(weights)
+            self.popularity[faq['id']] = (faq.get('upvotes', 0), faq.get('views', 0))
+
+    def _remove_locked(self, faq_id):
+        for term in self.faq_terms.pop(faq_id, ()):
+            posting = self.postings[term]
+            del posting[faq_id]
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+        self.popularity.pop(faq_id, None)
+
+    def remove(self, faq_id):
+        with self._lock:
+            self._remove_locked(faq_id)
+
+    def update_popularity(self, faq_id, upvotes, views):
+        with self._lock:
+            if faq_id in self.popularity:
+                self.popularity[faq_id] = (upvotes, views)
+
+    def _matches(self, token):
+        matches = Counter(self.postings.get(token, {}))
+        if len(token) >= FAQ_MIN_PREFIX:
+            start = bisect.bisect_right(self.terms, token)
+            for term in self.terms[start:]:
+                if not term.startswith(token):
+                    break
+                for faq_id, weight in self.postings[term].items():
+                    matches[faq_id] = max(matches[faq_id], weight)
+        return matches
+
+    def search(self, query, limit=None):
+        """Return matching FAQ ids, best first."""
+        # Compound tokens are not split here: "proj-1" should prefix-match "proj-102"
+        tokens = set(TOKEN_PATTERN.findall(query.lower()))
+        if not tokens:
+            return []
+        with self._lock:
+            scores = None
+            for token in tokens:
+                matches = self._matches(token)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = Counter({
+                        faq_id: score + matches[faq_id] for faq_id, score in scores.items() if faq_id in matches
+                    })
+                if not scores:
+                    return []
+            ranked = sorted(scores, key=lambda faq_id: (-scores[faq_id], *(-n for n in self.popularity[faq_id])))
+        return ranked[:limit] if limit else ranked
@@ -0,0 +1,1042 @@
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import itertools
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from uuid import uuid4
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache, LRUCache
+from ingestion import iter_document_segments
+from keyword_index import BM25Index, tokenize
+from vector_index import HNSW_EF_SEARCH, IVF_NPROBE, VectorIndex
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-MiniLM-L3-v2"
+
+# Characters per chunk; MiniLM truncates at 128 word pieces, roughly 500 characters
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# How many chunks to pull per requested document when grouping search results
+CHUNKS_PER_DOCUMENT = 4
+# Chunks embedded per model call while a document is streamed in
+EMBED_BATCH_SIZE = 64
+# Documents re-embedded and committed at a time by a rebuild, as in bulk imports
+REBUILD_BATCH_SIZE = 32
+# Result pages kept per process; cleared whenever the index changes
+RESULT_CACHE_SIZE = 512
+
+# "auto" picks flat, HNSW or IVF by vector count; see vector_index.py
+INDEX_TYPE = "auto"
+# None keeps float32 vectors in RAM; "sq8" (4x smaller) or "pq" (16x)
+# quantizes them and re-ranks candidates against the vectors in chunks.db
+QUANTIZATION = None
+
+# "hybrid" fuses BM25 keyword and vector rankings; the others use one of them
+SEARCH_MODES = ("hybrid", "semantic", "keyword")
+# Reciprocal rank fusion constant; larger values flatten the rank curve
+RRF_K = 60
+
+# The index is persisted next to the documents/ folder
+INDEX_DIR = "knowledge_index"
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.db"
+# Changes since the last snapshot, appended to the current generation's directory
+JOURNAL_FILE = "journal.jsonl"
+# The journal is folded into a full snapshot after this many changes, or on
+# the first change this long after the last snapshot, and at shutdown
+JOURNAL_COMPACT_CHANGES = 256
+JOURNAL_COMPACT_SECONDS = 15 * 60
+# Journaled chunks re-read from the chunk store at a time while loading
+JOURNAL_REPLAY_BATCH = 4096
+# Bump whenever the on-disk layout or chunk metadata changes
+INDEX_FORMAT_VERSION = 6
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def mmap_flag(index_kind):
+    """faiss read flag that memory-maps an index of this kind, or None.
+
+    IO_FLAG_MMAP only maps IVF inverted lists; flat, quantized and HNSW
+    storage is still read into RAM with it. IO_FLAG_MMAP_IFC (faiss >= 1.8)
+    maps every index type.
+    """
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if flag is not None:
+        return flag
+    return faiss.IO_FLAG_MMAP if index_kind == "ivf" else None
+
+
+def split_segments(splitter, segments):
+    """Yield (page, chunk_text) pairs for (page, text) segments.
+
+    Paged text is split page by page. Unpaged text may arrive in blocks; the
+    last chunk of each block is carried over so chunks do not end at
+    arbitrary block boundaries.
+    """
+    carry = ""
+    for page, text in segments:
+        if page is not None:
+            for chunk in splitter.split_text(text):
+                yield page, chunk
+            continue
+        chunks = splitter.split_text(carry + text)
+        carry = chunks.pop() if chunks else ""
+        for chunk in chunks:
+            yield None, chunk
+    if carry:
+        yield None, carry
+
+
+def load_embeddings(model_name=EMBEDDING_MODEL_NAME, cache=None):
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},  # Force CPU if GPU issues occur
+    )
+    # Unchanged chunk text is never embedded twice, across rebuilds and restarts
+    return CachedEmbeddings(embeddings, cache or EmbeddingCache(), model_name)
+
+
+class ReadWriteLock:
+    """Many concurrent readers or a single writer."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            # Waiting writers go first so a stream of searches cannot starve uploads
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class ChunkStore:
+    """Chunk texts and full-precision vectors on disk, keyed by vector id.
+
+    The vector index only keeps chunk metadata in RAM; texts are read back
+    for the handful of chunks that are actually displayed, and vectors for
+    re-ranking quantized search results and retraining.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            # Private in-memory database shared by this store's connections
+            path = f"file:chunks-{uuid4().hex}?mode=memory&cache=shared"
+        self.path = path
+        self._local = threading.local()
+        # Keeps an in-memory database alive for the lifetime of the store
+        self._keepalive = self._connect()
+        with self._keepalive as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (vector_id TEXT PRIMARY KEY, text TEXT NOT NULL, vector BLOB)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(chunks)")]
+            if 'vector' not in columns:
+                conn.execute("ALTER TABLE chunks ADD COLUMN vector BLOB")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, uri=self.path.startswith("file:"))
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def put_many(self, items):
+        """Store (vector_id, text, vector) triples."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (vector_id, text, vector) VALUES (?, ?, ?)",
+                [(vector_id, text, np.asarray(vector, dtype='float32').tobytes()) for vector_id, text, vector in items],
+            )
+
+    def delete_many(self, vector_ids):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE vector_id = ?", [(vector_id,) for vector_id in vector_ids])
+
+    def _select(self, column, vector_ids):
+        rows = {}
+        conn = self._connect()
+        for start in range(0, len(vector_ids), 500):
+            batch = vector_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.update(conn.execute(
+                f"SELECT vector_id, {column} FROM chunks WHERE vector_id IN ({placeholders}) AND {column} IS NOT NULL",
+                batch,
+            ).fetchall())
+        return rows
+
+    def get_many(self, vector_ids):
+        return self._select("text", vector_ids)
+
+    def get_vectors(self, vector_ids):
+        return {
+            vector_id: np.frombuffer(blob, dtype='float32')
+            for vector_id, blob in self._select("vector", vector_ids).items()
+        }
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chunks")
+
+
+class KnowledgeIndex:
+    """FAISS vector store that is updated one document at a time.
+
+    Every document owns a known set of vector ids, so uploads only embed the
+    new document and deletes/re-uploads only touch that document's vectors.
+    One instance is meant to be shared by every session of the process:
+    extraction and embedding run outside every lock, so searches, deletes
+    and other uploads carry on while a new document is embedded and only
+    wait for the short FAISS mutation.
+
+    Documents are streamed in as (page, text) segments and embedded in
+    batches; chunk texts go straight to the on-disk ChunkStore.
+    """
+
+    def __init__(self, embeddings=None, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                 index_dir=None, model_name=EMBEDDING_MODEL_NAME, index_type=INDEX_TYPE,
+                 nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH, quantization=QUANTIZATION):
+        self.model_name = model_name
+        # Recall/latency trade-offs; see python vector_index.py --report
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.quantization = quantization
+        self.embeddings = embeddings or load_embeddings(model_name)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.index_dir = index_dir
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        self.chunks = ChunkStore(os.path.join(index_dir, CHUNKS_FILE) if index_dir else None)
+        self.vector_store = None
+        # Keyword index over the same chunks, keyed by vector id
+        self.keywords = BM25Index()
+        self.doc_vector_ids = {}
+        # Enough about every indexed document to re-extract and re-embed it
+        self.doc_records = {}
+        self.generation = 0
+        # Bumped on every change to the indexed content; part of the result cache key
+        self.version = 0
+        self.results = LRUCache(RESULT_CACHE_SIZE)
+        self.memory_mapped = False
+        self.status = "empty"
+        self.lock = ReadWriteLock()
+        # Serialises the remove/add steps of writers; held only for the index
+        # update, never while a document is extracted or embedded
+        self._write_mutex = threading.Lock()
+        # Latest write started per document (None after a delete), so a slow
+        # upload cannot overwrite a newer upload or a delete of the same document
+        self._write_tickets = {}
+        self._tickets = itertools.count(1)
+        # Changes not yet journaled, in the order they were made
+        self._unsaved = deque()
+        self._journaled = 0
+        self._snapshot_at = time.monotonic()
+        # Orders journal appends and snapshots; taken after _write_mutex is released
+        self._persist_lock = threading.Lock()
+
+    def index_stats(self):
+        with self.lock.read():
+            if self.vector_store is None:
+                return {'kind': None, 'quantization': None, 'vectors': 0}
+            return {
+                'kind': self.vector_store.kind,
+                'quantization': self.vector_store.codes,
+                'vectors': len(self.vector_store),
+            }
+
+    def cache_stats(self):
+        cache = getattr(self.embeddings, 'cache', None)
+        if cache is None:
+            return None
+        stats = cache.stats()
+        queries = getattr(self.embeddings, 'queries', None)
+        if queries is not None:
+            stats['query_hits'] = queries.hits
+        stats['result_hits'] = self.results.hits
+        return stats
+
+    def _changed(self):
+        # Called with the write lock held
+        self.version += 1
+        self.results.clear()
+
+    def __len__(self):
+        with self.lock.read():
+            return len(self.doc_vector_ids)
+
+    def __contains__(self, doc_id):
+        with self.lock.read():
+            return doc_id in self.doc_vector_ids
+
+    def split_document(self, document):
+        """Yield (page, chunk_text) pairs; page is 1-based, None for plain text.
+
+        The text comes from document['segments'], an iterable of (page, text)
+        read lazily, or else from its 'pages' or 'content'.
+        """
+        segments = document.get('segments')
+        if segments is None:
+            pages = document.get('pages')
+            if pages:
+                segments = enumerate(pages, start=1)
+            else:
+                segments = [(None, document.get('content') or document.get('description') or document['title'])]
+
+        return split_segments(self.splitter, segments)
+
+    def _record(self, document):
+        record = {
+            'title': document['title'],
+            'type': document['type'],
+            'description': document.get('description', ""),
+            'file_path': document.get('file_path'),
+            'tags': list(document.get('tags') or []),
+            'uploaded_by': document.get('uploaded_by'),
+            'upload_date': document.get('upload_date'),
+        }
+        if record['file_path']:
+            record['fingerprint'] = file_fingerprint(record['file_path'])
+        return record
+
+    def _entries(self, document):
+        """Yield (vector_id, chunk_text, metadata) for every chunk of a document."""
+        # A fresh id prefix per upload lets the new chunks be written before
+        # the old ones are removed
+        prefix = f"{document['id']}:{uuid4().hex[:8]}"
+        # One list shared by every chunk of the document
+        tags = list(document.get('tags') or [])
+        for chunk_number, (page, chunk) in enumerate(self.split_document(document)):
+            vector_id = f"{prefix}:{chunk_number}"
+            yield vector_id, chunk, {
+                'id': vector_id,
+                'source': document['title'],
+                'type': document['type'],
+                'doc_id': document['id'],
+                'page': page,
+                'chunk': chunk_number,
+                # Filterable attributes; see vector_index.AttributeBitmaps
+                'tags': tags,
+                'uploaded_by': document.get('uploaded_by'),
+                'upload_date': document.get('upload_date'),
+            }
+
+    def _embed(self, documents):
+        """Stream every document through chunking and batched embedding.
+
+        Chunk texts are written to the chunk store as they are embedded, so
+        only vectors (as one float32 array), token counts and metadata are
+        kept until the index is updated.
+        """
+        pending = {'ids': [], 'vectors': [], 'metadatas': [], 'term_counts': []}
+        owners = {}
+        for document in documents:
+            owners[document['id']] = []
+            batch = []
+            for entry in self._entries(document):
+                batch.append(entry)
+                if len(batch) == EMBED_BATCH_SIZE:
+                    self._embed_batch(batch, pending)
+                    owners[document['id']].extend(entry[0] for entry in batch)
+                    batch = []
+            if batch:
+                self._embed_batch(batch, pending)
+                owners[document['id']].extend(entry[0] for entry in batch)
+        if pending['vectors']:
+            pending['vectors'] = np.concatenate(pending['vectors'])
+        else:
+            pending['vectors'] = np.empty((0, 0), dtype='float32')
+        return pending, owners
+
+    def _embed_batch(self, batch, pending):
+        vectors = np.asarray(self.embeddings.embed_documents([text for _, text, _ in batch]), dtype='float32')
+        pending['vectors'].append(vectors)
+        self.chunks.put_many([(vector_id, text, vector) for (vector_id, text, _), vector in zip(batch, vectors)])
+        pending['ids'].extend(vector_id for vector_id, _, _ in batch)
+        pending['metadatas'].extend(metadata for _, _, metadata in batch)
+        pending['term_counts'].extend(Counter(tokenize(text)) for _, text, _ in batch)
+
+    def add_documents(self, documents):
+        with self._write_mutex:
+            tickets = {}
+            for document in documents:
+                self._write_tickets[document['id']] = tickets[document['id']] = next(self._tickets)
+        try:
+            # The expensive part, extraction included, runs without any lock:
+            # searches, deletes and other uploads carry on meanwhile
+            pending, owners = self._embed(documents)
+        except Exception:
+            with self._write_mutex:
+                self._end_writes(tickets)
+            raise
+
+        with self._write_mutex:
+            superseded = self._end_writes(tickets)
+            if superseded:
+                self.chunks.delete_many([vector_id for doc_id in superseded for vector_id in owners.pop(doc_id)])
+                keep = [n for n, metadata in enumerate(pending['metadatas']) if metadata['doc_id'] in owners]
+                pending = {
+                    name: values[keep] if name == 'vectors' else [values[n] for n in keep]
+                    for name, values in pending.items()
+                }
+                documents = [document for document in documents if document['id'] in owners]
+            ids, vectors, metadatas = pending['ids'], pending['vectors'], pending['metadatas']
+            if not ids:
+                return []
+
+            with self.lock.write():
+                self._make_writable()
+                # Re-uploads replace the previous vectors of the same document
+                for doc_id in owners:
+                    self._remove_locked(doc_id)
+                self._add_locked(ids, vectors, metadatas, pending['term_counts'])
+                self.doc_vector_ids.update(owners)
+                for document in documents:
+                    self.doc_records[document['id']] = self._record(document)
+                if self.status != "rebuilding":
+                    self.status = "ready"
+                self._changed()
+                self._unsaved.append({
+                    'op': "add",
+                    'documents': {
+                        doc_id: dict(self.doc_records[doc_id], vector_ids=vector_ids)
+                        for doc_id, vector_ids in owners.items()
+                    },
+                    'chunks': metadatas,
+                })
+        # Outside the mutex, so the next document's embedding does not wait for it
+        self._persist()
+        return ids
+
+    def _end_writes(self, tickets):
+        """Called with _write_mutex held; returns the documents whose write was superseded."""
+        superseded = []
+        for doc_id, ticket in tickets.items():
+            current = self._write_tickets.get(doc_id)
+            if current != ticket:
+                superseded.append(doc_id)
+            if current in (ticket, None):
+                self._write_tickets.pop(doc_id, None)
+        return superseded
+
+    def add_document(self, document):
+        return self.add_documents([document])
+
+    def _make_writable(self):
+        # A memory-mapped index is read-only; read it into RAM before the first
+        # mutation (IVF's mapped inverted lists cannot be cloned)
+        if self.memory_mapped and self.vector_store is not None:
+            path = os.path.join(self.index_dir, f"v{self.generation}", "index.faiss")
+            self.vector_store.index = faiss.read_index(path)
+            self.memory_mapped = False
+
+    def _add_locked(self, ids, vectors, metadatas, term_counts):
+        # Texts live in the chunk store; the vector index only holds metadata
+        if self.vector_store is None:
+            self.vector_store = VectorIndex(
+                len(vectors[0]), self.index_type, self.nprobe, self.ef_search,
+                self.quantization, self.chunks.get_vectors,
+            )
+        self.vector_store.add(ids, vectors, metadatas)
+        for vector_id, counts in zip(ids, term_counts):
+            self.keywords.add(vector_id, counts)
+
+    def _remove_locked(self, doc_id):
+        ids = self.doc_vector_ids.pop(doc_id, None)
+        self.doc_records.pop(doc_id, None)
+        if ids and self.vector_store is not None:
+            self.vector_store.remove(ids)
+            self.chunks.delete_many(ids)
+            for vector_id in ids:
+                self.keywords.remove(vector_id)
+        return bool(ids)
+
+    def remove_document(self, doc_id):
+        with self._write_mutex:
+            if doc_id in self._write_tickets:
+                # Still being embedded: that upload must not add it back
+                self._write_tickets[doc_id] = None
+            with self.lock.write():
+                self._make_writable()
+                removed = self._remove_locked(doc_id)
+                if removed:
+                    self._changed()
+                    self._unsaved.append({'op': "remove", 'doc_id': doc_id})
+        if removed:
+            self._persist()
+        return removed
+
+    # Persistence
+
+    def _manifest_path(self):
+        return os.path.join(self.index_dir, MANIFEST_FILE)
+
+    def _settings(self):
+        return {
+            'format_version': INDEX_FORMAT_VERSION,
+            'model_name': self.model_name,
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+        }
+
+    def _tune(self, vector_store):
+        """Apply this process's index settings to a loaded vector index."""
+        vector_store.index_type = self.index_type
+        vector_store.nprobe = self.nprobe
+        vector_store.ef_search = self.ef_search
+        vector_store.quantization = self.quantization
+        vector_store.exact_vectors = self.chunks.get_vectors
+
+    def _journal_path(self):
+        return os.path.join(self.index_dir, f"v{self.generation}", JOURNAL_FILE)
+
+    def _persist(self):
+        """Append the queued changes to the current generation's journal.
+
+        Only the changed documents' records and chunk metadata are written
+        (vectors and texts are already in the chunk store), so the cost
+        follows the size of the change, not of the corpus. Every
+        JOURNAL_COMPACT_CHANGES changes the journal is folded into a new
+        snapshot instead.
+        """
+        if not self.index_dir:
+            self._unsaved.clear()
+            return
+        with self._persist_lock:
+            if not self.generation:
+                # Nothing to append to yet
+                self._snapshot()
+                return
+            entries = []
+            while self._unsaved:
+                entries.append(self._unsaved.popleft())
+            if entries:
+                with open(self._journal_path(), "a", encoding='utf-8') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journaled += len(entries)
+            if self._journaled >= JOURNAL_COMPACT_CHANGES or \
+                    (self._journaled and time.monotonic() - self._snapshot_at >= JOURNAL_COMPACT_SECONDS):
+                self._snapshot()
+
+    def compact(self):
+        """Fold the journal into a full snapshot; called at shutdown."""
+        if not self.index_dir:
+            return
+        with self._persist_lock:
+            if self._journaled or self._unsaved:
+                self._snapshot()
+
+    def _snapshot(self):
+        """Write a new index generation, then atomically switch the manifest to it.
+
+        Called with _persist_lock held. The state is captured under the read
+        lock, together with the queue of unsaved changes it already contains.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        generation = self.generation + 1
+        generation_dir = f"v{generation}"
+        tmp_dir = os.path.join(self.index_dir, f"tmp-{uuid4()}")
+        os.makedirs(tmp_dir)
+        # Left over from a save that crashed before the manifest was switched
+        shutil.rmtree(os.path.join(self.index_dir, generation_dir), ignore_errors=True)
+
+        with self.lock.read():
+            # Every queued change is part of the state written below
+            self._unsaved.clear()
+            names = []
+            if self.vector_store is not None:
+                faiss.write_index(self.vector_store.index, os.path.join(tmp_dir, "index.faiss"))
+                with open(os.path.join(tmp_dir, "index.pkl"), "wb") as f:
+                    pickle.dump((self.vector_store, self.keywords), f)
+                names = ["index.faiss", "index.pkl"]
+            manifest = dict(
+                self._settings(),
+                generation=generation,
+                directory=generation_dir,
+                saved_at=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                vector_count=sum(len(ids) for ids in self.doc_vector_ids.values()),
+                index_kind=self.vector_store.kind if self.vector_store is not None else None,
+                quantization=self.vector_store.codes if self.vector_store is not None else None,
+                documents={
+                    doc_id: dict(self.doc_records.get(doc_id, {}), vector_ids=ids)
+                    for doc_id, ids in self.doc_vector_ids.items()
+                },
+            )
+        # Checksums do not need the lock
+        manifest['files'] = {
+            name: {'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+            for name, path in ((name, os.path.join(tmp_dir, name)) for name in names)
+        }
+
+        os.replace(tmp_dir, os.path.join(self.index_dir, generation_dir))
+        tmp_manifest = self._manifest_path() + ".tmp"
+        with open(tmp_manifest, "w", encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_manifest, self._manifest_path())
+
+        previous = os.path.join(self.index_dir, f"v{self.generation}")
+        self.generation = generation
+        self._journaled = 0
+        self._snapshot_at = time.monotonic()
+        if os.path.isdir(previous):
+            shutil.rmtree(previous, ignore_errors=True)
+
+    def _read_manifest(self):
+        with open(self._manifest_path(), "r", encoding='utf-8') as f:
+            return json.load(f)
+
+    def _read_journal(self, manifest):
+        path = os.path.join(self.index_dir, manifest['directory'], JOURNAL_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        entries = []
+        for number, line in enumerate(lines, start=1):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                if number < len(lines):
+                    raise
+                # A crash while appending leaves at most a torn last line
+        return entries
+
+    @staticmethod
+    def _journal_documents(documents, journal):
+        """Apply journaled changes to the snapshot's document records.
+
+        Returns (documents, added): the records after every change, and the
+        chunk metadata of each journaled document still present, in order.
+        """
+        documents = dict(documents)
+        added = {}
+        for entry in journal:
+            if entry['op'] == "add":
+                documents.update(entry['documents'])
+                for doc_id in entry['documents']:
+                    added[doc_id] = []
+                for metadata in entry['chunks']:
+                    added[metadata['doc_id']].append(metadata)
+            else:
+                documents.pop(entry['doc_id'], None)
+                added.pop(entry['doc_id'], None)
+        return documents, added
+
+    def _stale_reason(self, manifest, documents):
+        for key, value in self._settings().items():
+            if manifest.get(key) != value:
+                return f"{key} changed"
+        for doc_id, record in documents.items():
+            if record.get('file_path') and file_fingerprint(record['file_path']) != record.get('fingerprint'):
+                return f"document {doc_id} changed on disk"
+        return None
+
+    def _load_generation(self, manifest, documents, added):
+        if not os.path.exists(os.path.join(self.index_dir, CHUNKS_FILE)):
+            raise ValueError(f"{CHUNKS_FILE} is missing")
+        # Replay the journal: drop replaced and deleted documents, then add
+        # the journaled chunks from the vectors and texts in the chunk store
+        snapshot_documents = manifest.get('documents', {})
+        stale = [
+            vector_id
+            for doc_id, record in snapshot_documents.items()
+            if documents.get(doc_id, {}).get('vector_ids') != record['vector_ids']
+            for vector_id in record['vector_ids']
+        ]
+        directory = os.path.join(self.index_dir, manifest['directory'])
+        if manifest['files']:
+            # A memory-mapped index is read-only, so only map it when nothing is replayed
+            vector_store, keywords, memory_mapped = self._load_snapshot(
+                manifest, directory, mmap=not added and not stale
+            )
+        else:
+            # Snapshot of an empty index (e.g. at the start of a rebuild)
+            vector_store, keywords, memory_mapped = None, BM25Index(), False
+
+        if stale:
+            vector_store.remove(stale)
+            for vector_id in stale:
+                keywords.remove(vector_id)
+        metadatas = [metadata for doc_id in added for metadata in added[doc_id]]
+        for start in range(0, len(metadatas), JOURNAL_REPLAY_BATCH):
+            batch = metadatas[start:start + JOURNAL_REPLAY_BATCH]
+            ids = [metadata['id'] for metadata in batch]
+            vectors = self.chunks.get_vectors(ids)
+            texts = self.chunks.get_many(ids)
+            if len(vectors) != len(ids) or len(texts) != len(ids):
+                raise ValueError("journaled chunks are missing from the chunk store")
+            if vector_store is None:
+                vector_store = VectorIndex(
+                    len(vectors[ids[0]]), self.index_type, self.nprobe, self.ef_search,
+                    self.quantization, self.chunks.get_vectors,
+                )
+            vector_store.add(ids, np.stack([vectors[vector_id] for vector_id in ids]), batch)
+            for vector_id in ids:
+                keywords.add(vector_id, Counter(tokenize(texts[vector_id])))
+        if vector_store is None or len(vector_store) != sum(len(record['vector_ids']) for record in documents.values()):
+            raise ValueError("vector count does not match the manifest and journal")
+        self._tune(vector_store)
+        return vector_store, keywords, memory_mapped
+
+    def _load_snapshot(self, manifest, directory, mmap=True):
+        for name, expected in manifest['files'].items():
+            path = os.path.join(directory, name)
+            if os.path.getsize(path) != expected['size']:
+                raise ValueError(f"{name} has the wrong size")
+        # The FAISS file is only size-checked so that cold starts stay cheap;
+        # the metadata/keyword pickle is fully verified before it is unpickled
+        pkl_path = os.path.join(directory, "index.pkl")
+        if file_sha256(pkl_path) != manifest['files']['index.pkl']['sha256']:
+            raise ValueError("index.pkl checksum mismatch")
+        memory_mapped = False
+        flag = mmap_flag(manifest.get('index_kind')) if mmap else None
+        if flag is not None:
+            try:
+                index = faiss.read_index(os.path.join(directory, "index.faiss"), flag | faiss.IO_FLAG_READ_ONLY)
+                memory_mapped = True
+            except RuntimeError:
+                # Not every index type can be memory-mapped
+                pass
+        if not memory_mapped:
+            index = faiss.read_index(os.path.join(directory, "index.faiss"))
+        with open(pkl_path, "rb") as f:
+            vector_store, keywords = pickle.load(f)
+        # Masked HNSW deletions are still counted by FAISS
+        if len(vector_store) != manifest['vector_count'] or \
+                index.ntotal - len(vector_store.deleted) != manifest['vector_count']:
+            raise ValueError("vector count does not match the manifest")
+        vector_store.index = index
+        return vector_store, keywords, memory_mapped
+
+    def load(self):
+        """Load the persisted index; rebuild it in the background if stale or corrupt.
+
+        Returns the reason for a rebuild, or None when the index was loaded as is.
+        """
+        if not self.index_dir or not os.path.exists(self._manifest_path()):
+            return None
+        try:
+            manifest = self._read_manifest()
+        except (OSError, ValueError) as e:
+            self.status = "unavailable"
+            return f"manifest unreadable: {e}"
+
+        self.generation = manifest.get('generation', 0)
+        try:
+            journal = self._read_journal(manifest)
+        except (OSError, ValueError) as e:
+            journal = None
+            documents, added = manifest.get('documents', {}), {}
+            reason = f"journal unreadable: {e}"
+        else:
+            self._journaled = len(journal)
+            documents, added = self._journal_documents(manifest.get('documents', {}), journal)
+            reason = self._stale_reason(manifest, documents)
+        if reason is None and documents:
+            try:
+                vector_store, keywords, memory_mapped = self._load_generation(manifest, documents, added)
+            except Exception as e:
+                reason = f"index files corrupt: {e}"
+            else:
+                with self.lock.write():
+                    self.vector_store = vector_store
+                    self.keywords = keywords
+                    self.memory_mapped = memory_mapped
+                    self.doc_vector_ids = {doc_id: record['vector_ids'] for doc_id, record in documents.items()}
+                    self.doc_records = {
+                        doc_id: {key: value for key, value in record.items() if key != 'vector_ids'}
+                        for doc_id, record in documents.items()
+                    }
+                    self.status = "ready"
+                    self._changed()
+                # A changed index type or size threshold takes effect right away
+                with self._write_mutex:
+                    with self.lock.write():
+                        converted = self.vector_store.restructure()
+                        if converted:
+                            self.memory_mapped = False
+                    # Replayed changes are folded into a snapshot the next start can map
+                    if converted or journal:
+                        with self._persist_lock:
+                            self._snapshot()
+                return None
+
+        if reason is not None:
+            self.status = "rebuilding"
+            threading.Thread(target=self.rebuild, args=(documents,), daemon=True).start()
+        return reason
+
+    def rebuild(self, records):
+        """Re-extract and re-embed the documents recorded in a manifest.
+
+        Documents are committed REBUILD_BATCH_SIZE at a time, so memory stays
+        bounded and search results come back while the rest is re-embedded.
+        """
+        documents = []
+        for doc_id, record in records.items():
+            if record.get('file_path') and not os.path.exists(record['file_path']):
+                continue
+            documents.append({'id': doc_id, **{key: value for key, value in record.items() if key != 'vector_ids'}})
+
+        try:
+            with self._write_mutex:
+                with self.lock.write():
+                    self.vector_store = None
+                    self.keywords = BM25Index()
+                    self.memory_mapped = False
+                    self.doc_vector_ids = {}
+                    self.doc_records = {}
+                    self.chunks.clear()
+                    self._changed()
+                # The old generation refers to chunks that are gone now
+                if self.index_dir:
+                    with self._persist_lock:
+                        self._snapshot()
+            for start in range(0, len(documents), REBUILD_BATCH_SIZE):
+                batch = documents[start:start + REBUILD_BATCH_SIZE]
+                for document in batch:
+                    # Text is read lazily while the document is embedded
+                    document['segments'] = iter_document_segments(document)
+                self.add_documents(batch)
+            self.compact()
+            self.status = "ready"
+        except Exception:
+            self.status = "unavailable"
+            raise
+
+    def _chunk(self, vector_id):
+        # Text is filled in later by load_chunk_texts
+        return Document(page_content="", metadata=self.vector_store.get(vector_id))
+
+    def _vector_hits(self, query, n, filters=None):
+        embedding = self.embeddings.embed_query(query)
+        with self.lock.read():
+            if self.vector_store is None:
+                return []
+            allowed = self.vector_store.filter(filters)
+            return [self._chunk(vector_id) for vector_id, _ in self.vector_store.search(embedding, n, allowed)]
+
+    def _keyword_hits(self, query, n, filters=None):
+        # Never touches the embedding model
+        with self.lock.read():
+            if self.vector_store is None:
+                return []
+            allowed = self.vector_store.filter(filters)
+            if allowed is not None:
+                labels = self.vector_store.labels
+                hits = self.keywords.search(query, n, lambda vector_id: labels.get(vector_id, -1) in allowed)
+            else:
+                hits = self.keywords.search(query, n)
+            return [self._chunk(vector_id) for vector_id, _ in hits]
+
+    def search(self, query, k=3, mode="hybrid", filters=None):
+        """Return the k best chunks as (Document, score) pairs, best first.
+
+        Scores are reciprocal-rank-fusion scores over the keyword and/or
+        vector rankings selected by mode, so higher is better in every mode.
+        filters restricts the chunks searched by type, tags, uploaded_by
+        (lists of accepted values) and date_from/date_to ("YYYY-MM-DD").
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        if not len(self):
+            return []
+        rankings = []
+        if mode in ("hybrid", "keyword"):
+            rankings.append(self._keyword_hits(query, k, filters))
+        if mode in ("hybrid", "semantic"):
+            rankings.append(self._vector_hits(query, k, filters))
+
+        scores, chunks = Counter(), {}
+        for ranking in rankings:
+            for rank, chunk in enumerate(ranking):
+                vector_id = chunk.metadata['id']
+                chunks[vector_id] = chunk
+                scores[vector_id] += 1 / (RRF_K + rank + 1)
+        return [(chunks[vector_id], score) for vector_id, score in scores.most_common(k)]
+
+    def load_chunk_texts(self, chunks):
+        """Return copies of search-hit chunks with their text read from disk."""
+        texts = self.chunks.get_many([chunk.metadata['id'] for chunk in chunks])
+        return [
+            Document(page_content=texts.get(chunk.metadata['id'], ""), metadata=dict(chunk.metadata))
+            for chunk in chunks
+        ]
+
+    def search_documents(self, query, k=3, offset=0, mode="hybrid", chunks_per_document=CHUNKS_PER_DOCUMENT,
+                         filters=None):
+        """Return documents offset..offset+k, each with its best matching chunks.
+
+        Documents are ranked by their best chunk. Only the returned chunks
+        have their text loaded. Pages are cached until the index changes, so
+        repeating a search touches neither the model nor the index.
+        """
+        filter_key = tuple(sorted(
+            (name, tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else value)
+            for name, value in (filters or {}).items() if value
+        ))
+        key = (query, k, offset, mode, chunks_per_document, filter_key, self.version)
+        page = self.results.get(key)
+        if page is None:
+            page = self._search_documents(query, k, offset, mode, chunks_per_document, filters)
+            self.results.put(key, page)
+        # Callers get their own group dicts; the chunk Documents are shared
+        return [dict(group, chunks=list(group['chunks'])) for group in page]
+
+    def _search_documents(self, query, k, offset, mode, chunks_per_document, filters):
+        # One long document can take up every candidate chunk, so widen the
+        # search until enough distinct documents are found or results run out
+        n = (offset + k) * chunks_per_document
+        while True:
+            hits = self.search(query, k=n, mode=mode, filters=filters)
+            groups = self._group_hits(hits, offset + k, chunks_per_document)
+            if len(groups) >= offset + k or len(hits) < n:
+                break
+            n *= 2
+        page = list(groups.values())[offset:offset + k]
+        for group in page:
+            group['chunks'] = self.load_chunk_texts(group['chunks'])
+        return page
+
+    @staticmethod
+    def _group_hits(hits, max_documents, chunks_per_document):
+        """Group ranked chunks by document, keeping the first max_documents documents."""
+        groups = {}
+        for chunk, score in hits:
+            doc_id = chunk.metadata['doc_id']
+            if doc_id not in groups:
+                if len(groups) == max_documents:
+                    continue
+                groups[doc_id] = {
+                    'doc_id': doc_id,
+                    'source': chunk.metadata['source'],
+                    'type': chunk.metadata['type'],
+                    'score': score,
+                    'chunks': [],
+                }
+            if len(groups[doc_id]['chunks']) < chunks_per_document:
+                groups[doc_id]['chunks'].append(chunk)
+        return groups
+
+
+# Cosine similarity at which a new FAQ is offered for merging into an existing one
+FAQ_DUPLICATE_THRESHOLD = 0.85
+# Minimum cosine similarity for an FAQ to be shown as a related question
+FAQ_SIMILAR_THRESHOLD = 0.6
+# HNSW graph degree and search breadth for the FAQ index
+FAQ_HNSW_M = 32
+FAQ_HNSW_EF_SEARCH = 64
+
+
+class FaqVectorIndex:
+    """HNSW index over FAQ questions for duplicate detection and semantic browse.
+
+    Vectors are normalised so inner product is cosine similarity. The index
+    lives in memory and is rebuilt from the store at start-up, which the
+    embedding cache makes cheap.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.index = None
+        # FAISS ids are positions in this list
+        self.faq_ids = []
+        self.positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.faq_ids)
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype='float32')
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def add_many(self, faqs):
+        faqs = [faq for faq in faqs if faq['id'] not in self.positions]
+        if not faqs:
+            return
+        vectors = self._normalize(self.embeddings.embed_documents([faq['question'] for faq in faqs]))
+        with self._lock:
+            if self.index is None:
+                hnsw = faiss.IndexHNSWFlat(vectors.shape[1], FAQ_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+                hnsw.hnsw.efSearch = FAQ_HNSW_EF_SEARCH
+                self.index = faiss.IndexIDMap2(hnsw)
+            start = len(self.faq_ids)
+            for faq in faqs:
+                self.positions[faq['id']] = len(self.faq_ids)
+                self.faq_ids.append(faq['id'])
+            self.index.add_with_ids(vectors, np.arange(start, len(self.faq_ids), dtype='int64'))
+
+    def similar(self, text, k=5, threshold=FAQ_SIMILAR_THRESHOLD):
+        """Return up to k (faq_id, similarity) pairs at or above threshold, best first."""
+        if not self.faq_ids:
+            return []
+        query = self._normalize([self.embeddings.embed_query(text)])
+        with self._lock:
+            similarities, ids = self.index.search(query, min(k, len(self.faq_ids)))
+        return [
+            (self.faq_ids[faq_position], float(similarity))
+            for similarity, faq_position in zip(similarities[0], ids[0])
+            if faq_position >= 0 and similarity >= threshold
+        ]
@@ -0,0 +1,142 @@
+"""Pluggable LLM backends for the AI features.
+
+Pick one with the KP_LLM_BACKEND environment variable:
+
+    huggingface  remote Mistral-7B endpoint (default; needs an API token)
+    llama_cpp    local CPU model through llama-cpp-python (KP_LLAMA_MODEL=/path/model.gguf)
+    server       local HTTP server speaking llama.cpp's /completion API (KP_LLM_SERVER_URL),
+                 e.g. llama.cpp's own server or `python stub_llm_server.py`
+
+Every backend streams text pieces as they are generated. The HTTP backends
+share one pooled LLMClient each (see llm_client.py).
+"""
+import os
+import threading
+
+from llm_client import LLMClient
+
+LLM_BACKEND = os.environ.get("KP_LLM_BACKEND", "huggingface")
+HUGGINGFACE_REPO_ID = "mistralai/Mistral-7B-Instruct-v0.3"
+HUGGINGFACE_API_URL = "https://api-inference.huggingface.co"
+LLAMA_MODEL_PATH = os.environ.get("KP_LLAMA_MODEL", "models/mistral-7b-instruct.Q4_K_M.gguf")
+LLAMA_CONTEXT_TOKENS = 4096
+LLAMA_THREADS = os.cpu_count() or 4
+LLM_SERVER_URL = os.environ.get("KP_LLM_SERVER_URL", "http://127.0.0.1:8080")
+
+# Generation settings shared by every backend
+MAX_NEW_TOKENS = 512
+TEMPERATURE = 0.3
+TOP_K = 10
+TOP_P = 0.95
+
+
+class LLMBackend:
+    """Base class: stream(prompt) yields generated text pieces."""
+
+    name = "base"
+    # Identifies the model for response caching
+    model_id = ""
+    # Total prompt + completion tokens the model accepts
+    context_tokens = LLAMA_CONTEXT_TOKENS
+
+    def count_tokens(self, text):
+        # Roughly four characters per token for English with Llama/Mistral tokenizers
+        return len(text) // 4 + 1
+
+    def stream(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        raise NotImplementedError
+
+    def generate(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        return "".join(self.stream(prompt, max_new_tokens))
+
+
+class HuggingFaceBackend(LLMBackend):
+    """The hosted Mistral-7B endpoint, streamed token by token."""
+
+    name = "huggingface"
+    context_tokens = 32768
+
+    def __init__(self, api_token, repo_id=HUGGINGFACE_REPO_ID, client=None):
+        self.repo_id = repo_id
+        self.model_id = repo_id
+        self.client = client or LLMClient(HUGGINGFACE_API_URL, headers={'Authorization': f"Bearer {api_token}"})
+
+    def stream(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        payload = {
+            'inputs': prompt,
+            'parameters': {
+                'max_new_tokens': max_new_tokens, 'temperature': TEMPERATURE, 'top_k': TOP_K, 'top_p': TOP_P,
+                'return_full_text': False,
+            },
+            'stream': True,
+        }
+        for event in self.client.stream_events(f"/models/{self.repo_id}", payload):
+            token = event.get('token') or {}
+            if token.get('text') and not token.get('special'):
+                yield token['text']
+
+
+class LlamaCppBackend(LLMBackend):
+    """A quantized GGUF model run on the CPU in this process."""
+
+    name = "llama_cpp"
+
+    def __init__(self, model_path=LLAMA_MODEL_PATH, context_tokens=LLAMA_CONTEXT_TOKENS, threads=LLAMA_THREADS):
+        # Optional dependency: pip install llama-cpp-python
+        from llama_cpp import Llama
+
+        self.context_tokens = context_tokens
+        self.model_id = os.path.basename(model_path)
+        self.llm = Llama(model_path=model_path, n_ctx=context_tokens, n_threads=threads, verbose=False)
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text):
+        return len(self.llm.tokenize(text.encode('utf-8'), add_bos=False))
+
+    def stream(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        # The llama.cpp context is not thread-safe; sessions' generations take
+        # turns. The lock is released when the caller stops reading, too.
+        with self._lock:
+            parts = self.llm(
+                prompt, max_tokens=max_new_tokens, temperature=TEMPERATURE, top_k=TOP_K, top_p=TOP_P, stream=True
+            )
+            try:
+                for part in parts:
+                    text = part['choices'][0]['text']
+                    if text:
+                        yield text
+            finally:
+                parts.close()
+
+
+class ServerBackend(LLMBackend):
+    """A local server with llama.cpp's /completion API, streamed as server-sent events."""
+
+    name = "server"
+
+    def __init__(self, url=LLM_SERVER_URL, client=None):
+        self.client = client or LLMClient(url)
+        self.model_id = self.client.base_url
+
+    def stream(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        payload = {
+            'prompt': prompt, 'n_predict': max_new_tokens, 'temperature': TEMPERATURE,
+            'top_k': TOP_K, 'top_p': TOP_P, 'stream': True,
+        }
+        stopped = False
+        # Read to the end of the stream (it ends right after the stop event)
+        # so the connection goes back to the pool
+        for event in self.client.stream_events("/completion", payload):
+            if event.get('content') and not stopped:
+                yield event['content']
+            stopped = stopped or event.get('stop')
+
+
+def load_backend(name=LLM_BACKEND, api_token=None):
+    if name == "huggingface":
+        return HuggingFaceBackend(api_token)
+    if name == "llama_cpp":
+        return LlamaCppBackend()
+    if name == "server":
+        return ServerBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
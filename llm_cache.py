@@ -0,0 +1,190 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+from llm_backends import MAX_NEW_TOKENS, TEMPERATURE, TOP_K, TOP_P, LLMBackend
+
+RESPONSE_CACHE_PATH = "llm_response_cache.db"
+# Answers are reused for a week; the prompt includes the retrieved excerpts,
+# so new or changed documents produce a new key anyway
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so reflowed but identical prompts share an entry."""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+class ResponseCache:
+    """Persistent LLM response cache with a TTL and LRU eviction."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(prompt, **params):
+        settings = "\0".join(f"{name}={params[name]}" for name in sorted(params))
+        return hashlib.sha256(f"{settings}\0{normalize_prompt(prompt)}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT response FROM responses WHERE key = ? AND created > ?", (key, time.time() - self.ttl)
+        ).fetchone()
+        if row:
+            with conn:
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        with self._stats_lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row[0] if row else None
+
+    def put(self, key, response):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+            overflow = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+
+    def stats(self):
+        entries = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+class SharedStream:
+    """One generation read by any number of concurrent consumers.
+
+    A background thread drains the backend into a buffer; every reader
+    replays the buffer from the start and then waits for new pieces.
+    """
+
+    def __init__(self, pieces, on_done):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, args=(pieces, on_done), daemon=True)
+        self._thread.start()
+
+    def _run(self, pieces, on_done):
+        try:
+            for piece in pieces:
+                with self._cond:
+                    self.pieces.append(piece)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            on_done(self)
+
+    def __iter__(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position == len(self.pieces) and not self.done:
+                    self._cond.wait()
+                available = self.pieces[position:]
+                done = self.done
+            for piece in available:
+                yield piece
+            position += len(available)
+            if done and position == len(self.pieces):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class CachedBackend(LLMBackend):
+    """Wraps an LLM backend with the response cache and request coalescing.
+
+    A cached answer is replayed at once. Identical prompts already being
+    generated for another user attach to that generation instead of
+    calling the backend again.
+    """
+
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache or ResponseCache()
+        self.name = backend.name
+        self.context_tokens = backend.context_tokens
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text):
+        return self.backend.count_tokens(text)
+
+    def _key(self, prompt, max_new_tokens):
+        return ResponseCache.key(
+            prompt, backend=self.backend.name, model=getattr(self.backend, 'model_id', ""),
+            max_new_tokens=max_new_tokens, temperature=TEMPERATURE, top_k=TOP_K, top_p=TOP_P,
+        )
+
+    def stream(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        key = self._key(prompt, max_new_tokens)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        with self._lock:
+            shared = self._inflight.get(key)
+            if shared is None:
+                shared = self._inflight[key] = SharedStream(
+                    self.backend.stream(prompt, max_new_tokens), lambda stream: self._finish(key, stream)
+                )
+            else:
+                self.coalesced += 1
+        yield from shared
+
+    def _finish(self, key, stream):
+        if stream.error is None:
+            self.cache.put(key, "".join(stream.pieces))
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        stats = dict(self.cache.stats(), coalesced=self.coalesced)
+        client = getattr(self.backend, 'client', None)
+        if client is not None:
+            stats['client'] = client.stats()
+        return stats
@@ -0,0 +1,241 @@
+"""Long-lived HTTP client for LLM servers.
+
+One LLMClient per server is shared by every session. It keeps connections
+alive in a pool, bounds the number of concurrent generations, gives every
+request a deadline, retries transient failures with exponential backoff
+and stops calling a failing server for a while (circuit breaker).
+
+Try it against the stub server:
+
+    python stub_llm_server.py --port 8080 --error-rate 0.3
+    KP_LLM_BACKEND=server streamlit run KnowledgeApp_v2.py
+"""
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Keep-alive connections held open per server
+LLM_POOL_SIZE = 8
+# Generations running at once; further requests wait for a slot
+LLM_MAX_CONCURRENCY = 4
+# Longest wait for a slot before giving up
+LLM_QUEUE_TIMEOUT = 15
+LLM_CONNECT_TIMEOUT = 3.05
+# End-to-end limit per request, including the streamed response
+LLM_DEADLINE = 90
+LLM_RETRIES = 3
+LLM_BACKOFF = 0.5
+LLM_BACKOFF_MAX = 8
+# Consecutive failures that open the breaker, and how long it stays open
+BREAKER_FAILURES = 5
+BREAKER_RESET_SECONDS = 30
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class LLMClientError(Exception):
+    pass
+
+
+class CircuitOpenError(LLMClientError):
+    pass
+
+
+class DeadlineExceeded(LLMClientError):
+    pass
+
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half-open trial -> closed."""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """True to go ahead, "trial" for the one half-open probe, False to stay away."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                # Let exactly one request probe the server
+                self._trial = True
+                return "trial"
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self, trial=False):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+            if trial:
+                self._trial = False
+
+    def end_trial(self):
+        """Free the half-open trial slot; only for the caller allow() gave it to."""
+        with self._lock:
+            self._trial = False
+
+
+class LLMClient:
+    """Pooled, deadline-bound client for one LLM server."""
+
+    def __init__(self, base_url, headers=None, pool_size=LLM_POOL_SIZE, max_concurrency=LLM_MAX_CONCURRENCY,
+                 deadline=LLM_DEADLINE, retries=LLM_RETRIES, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.deadline = deadline
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        # Retries are handled here, with backoff and the breaker in the loop
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._stats_lock = threading.Lock()
+        self.stats_counters = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'active': 0}
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats_counters[name] += n
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self.stats_counters, breaker=self.breaker.state)
+
+    def _backoff(self, attempt, ends):
+        delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1)
+        if time.monotonic() + delay >= ends:
+            raise DeadlineExceeded("deadline exceeded while retrying")
+        time.sleep(delay)
+
+    def _open(self, path, payload, stream, ends):
+        """POST with retries; returns a response with a 2xx status."""
+        attempt = 0
+        while True:
+            allowed = self.breaker.allow()
+            if not allowed:
+                self._count('rejected')
+                raise CircuitOpenError(f"{self.base_url} is failing; not calling it for a while")
+            trial = allowed == "trial"
+            try:
+                response, error = self._attempt(path, payload, stream, ends, trial)
+            finally:
+                if trial:
+                    # Deadlines and unexpected errors must not hold the trial forever
+                    self.breaker.end_trial()
+            if response is not None:
+                return response
+            if attempt >= self.retries:
+                raise error
+            attempt += 1
+            self._count('retries')
+            self._backoff(attempt, ends)
+
+    def _attempt(self, path, payload, stream, ends, trial=False):
+        """One POST; returns (response, None) or (None, retryable error) and updates the breaker."""
+        remaining = ends - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline exceeded")
+        try:
+            response = self.session.post(
+                f"{self.base_url}{path}", json=payload, stream=stream,
+                timeout=(min(LLM_CONNECT_TIMEOUT, remaining), remaining),
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.breaker.record_failure(trial)
+            self._count('failures')
+            return None, e
+        if response.status_code < 400:
+            self.breaker.record_success()
+            return response, None
+        error = LLMClientError(f"{response.status_code} {response.reason}")
+        response.close()
+        if response.status_code < 500 and response.status_code not in RETRYABLE_STATUSES:
+            # The request itself is wrong; the server is reachable and fine
+            self.breaker.record_success()
+            raise error
+        self.breaker.record_failure(trial)
+        self._count('failures')
+        if response.status_code not in RETRYABLE_STATUSES:
+            raise error
+        return None, error
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+            self._count('rejected')
+            raise LLMClientError("too many requests in progress; try again shortly")
+        self._count('active')
+
+    def _release(self):
+        self._count('active', -1)
+        self._slots.release()
+
+    def post_json(self, path, payload, deadline=None):
+        ends = time.monotonic() + (deadline or self.deadline)
+        self._count('requests')
+        self._acquire()
+        try:
+            response = self._open(path, payload, False, ends)
+            return response.json()
+        finally:
+            self._release()
+
+    def stream_events(self, path, payload, deadline=None):
+        """POST and yield the JSON payload of each server-sent event.
+
+        Failures before the first event are retried; once events have been
+        yielded, an error is raised to the caller instead.
+        """
+        ends = time.monotonic() + (deadline or self.deadline)
+        self._count('requests')
+        self._acquire()
+        try:
+            # The caller may stop reading at any point
+            response = self._open(path, payload, True, ends)
+            try:
+                for line in response.iter_lines():
+                    if time.monotonic() > ends:
+                        raise DeadlineExceeded("deadline exceeded while streaming")
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[len(b"data:"):].strip()
+                    if data == b"[DONE]":
+                        break
+                    yield json.loads(data)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record_failure()
+                self._count('failures')
+                raise LLMClientError(f"connection lost while streaming: {e}") from e
+            finally:
+                response.close()
+        finally:
+            self._release()
@@ -0,0 +1,162 @@
+"""Serves finished podcast audio straight from disk, with HTTP range requests.
+
+Browsers fetch audio in ranges to seek and to start playing early, so the
+page only needs a URL. Nothing is held in the Streamlit process's memory,
+and a file is read in blocks as it is sent.
+
+    python media_server.py --root C:/temp/podcast_app/podcasts --port 8503
+
+The portal only links to it when KP_MEDIA_URL gives the address browsers
+reach it at; otherwise podcasts are sent inline through Streamlit.
+"""
+import argparse
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+MEDIA_PORT = int(os.environ.get("KP_MEDIA_PORT", "8503"))
+# Address browsers use to reach this server, e.g. http://portal.example.com:8503
+MEDIA_URL = os.environ.get("KP_MEDIA_URL")
+SEND_BLOCK_SIZE = 64 * 1024
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Only the encoded audio and chapter indexes are served; sources, transcripts
+# and uncompressed WAV files stay private
+CONTENT_TYPES = {'.ogg': "audio/ogg", '.opus': "audio/ogg", '.mp3': "audio/mpeg", '.ulaw.wav': "audio/wav",
+                 '.json': "application/json"}
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single-range Range header; None if unsatisfiable.
+
+    Returns (0, size - 1) for a missing or malformed header, which is then
+    ignored as the HTTP spec allows.
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if match is None or match.groups() == ("", ""):
+        return 0, size - 1
+    first, last = match.groups()
+    if first == "":
+        # bytes=-N: the last N bytes
+        length = int(last)
+        if length == 0:
+            return None
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return None
+    return start, end
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    root = "."
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            # Players abort requests all the time when seeking
+            pass
+
+    def _resolve(self, url_path):
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, unquote(url_path).lstrip("/")))
+        if not path.startswith(root + os.sep) or not path.endswith(tuple(CONTENT_TYPES)):
+            return None
+        return path if os.path.isfile(path) else None
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        url = urlsplit(self.path)
+        path = self._resolve(url.path)
+        if path is None:
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        name = os.path.basename(path)
+        content_type = next(mime for suffix, mime in CONTENT_TYPES.items() if name.endswith(suffix))
+        byte_range = parse_range(self.headers.get('Range'), size) if size else (0, -1)
+        if byte_range is None:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = byte_range
+        partial = self.headers.get('Range') is not None and (start, end) != (0, size - 1)
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Cache-Control", "public, max-age=86400")
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        if 'download' in parse_qs(url.query, keep_blank_values=True):
+            self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+        self.end_headers()
+        if not send_body:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(SEND_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                self.wfile.write(block)
+                remaining -= len(block)
+
+
+class MediaServer:
+    """A MediaHandler server on a background thread."""
+
+    def __init__(self, root, host="0.0.0.0", port=MEDIA_PORT, public_url=MEDIA_URL):
+        if not public_url:
+            raise ValueError("public_url (KP_MEDIA_URL) is needed to link to the media server")
+        handler = type("BoundMediaHandler", (MediaHandler,), {'root': root})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.public_url = public_url.rstrip("/")
+        self.root = root
+        self._thread = threading.Thread(target=self.server.serve_forever, name="media-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path, download=False):
+        """Public URL of a file under the root."""
+        relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+        return f"{self.public_url}/{relative}" + ("?download" if download else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve podcast audio with HTTP range requests.")
+    parser.add_argument("--root", required=True)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=MEDIA_PORT)
+    args = parser.parse_args()
+    MediaHandler.root = args.root
+    server = ThreadingHTTPServer((args.host, args.port), MediaHandler)
+    print(f"Serving {args.root} on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
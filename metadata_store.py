@@ -0,0 +1,441 @@
+import datetime
+import json
+import sqlite3
+import threading
+
+DB_PATH = "knowledge_portal.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    type TEXT NOT NULL,
+    file_path TEXT,
+    upload_date TEXT NOT NULL,
+    uploaded_by TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_documents_type_date ON documents (type, upload_date);
+CREATE INDEX IF NOT EXISTS idx_documents_upload_date ON documents (upload_date);
+CREATE INDEX IF NOT EXISTS idx_documents_title ON documents (title);
+
+CREATE TABLE IF NOT EXISTS document_tags (
+    doc_id TEXT NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (doc_id, tag)
+);
+CREATE INDEX IF NOT EXISTS idx_document_tags_tag ON document_tags (tag, doc_id);
+
+CREATE TABLE IF NOT EXISTS faqs (
+    id TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_date TEXT NOT NULL,
+    created_by TEXT,
+    upvotes INTEGER NOT NULL DEFAULT 0,
+    views INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_faqs_created_date ON faqs (created_date);
+
+CREATE TABLE IF NOT EXISTS faq_tags (
+    faq_id TEXT NOT NULL REFERENCES faqs (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (faq_id, tag)
+);
+CREATE INDEX IF NOT EXISTS idx_faq_tags_tag ON faq_tags (tag, faq_id);
+
+CREATE TABLE IF NOT EXISTS handovers (
+    id TEXT PRIMARY KEY,
+    employee_name TEXT NOT NULL,
+    last_working_day TEXT NOT NULL,
+    created_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    projects TEXT NOT NULL,
+    sections TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_handovers_last_working_day ON handovers (last_working_day);
+CREATE INDEX IF NOT EXISTS idx_handovers_status ON handovers (status);
+
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    doc_id TEXT PRIMARY KEY REFERENCES documents (id) ON DELETE CASCADE,
+    status TEXT NOT NULL,
+    error TEXT,
+    enqueued_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status, enqueued_at);
+
+CREATE TABLE IF NOT EXISTS podcast_jobs (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    segments_done INTEGER NOT NULL DEFAULT 0,
+    segments_total INTEGER,
+    error TEXT,
+    enqueued_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_podcast_jobs_status ON podcast_jobs (status, enqueued_at);
+"""
+
+# Ingestion job lifecycle, in order
+JOB_QUEUED = "queued"
+JOB_EXTRACTING = "extracting"
+JOB_EMBEDDING = "embedding"
+JOB_INDEXED = "indexed"
+JOB_FAILED = "failed"
+JOB_ACTIVE_STATUSES = (JOB_QUEUED, JOB_EXTRACTING, JOB_EMBEDDING)
+
+# Podcast jobs are queued, then synthesizing, then ready (or failed)
+PODCAST_SYNTHESIZING = "synthesizing"
+PODCAST_READY = "ready"
+PODCAST_ACTIVE_STATUSES = (JOB_QUEUED, PODCAST_SYNTHESIZING)
+
+DOCUMENT_COLUMNS = ("id", "title", "description", "type", "file_path", "upload_date", "uploaded_by")
+FAQ_COLUMNS = ("id", "question", "answer", "created_date", "created_by", "upvotes", "views")
+HANDOVER_COLUMNS = ("id", "employee_name", "last_working_day", "created_date", "status", "projects", "sections")
+
+
+class MetadataStore:
+    """SQLite (WAL mode) store for documents, FAQs and handovers.
+
+    Records go in and come out as the same dicts the app used to keep in
+    st.session_state. Each thread gets its own connection; WAL lets any
+    number of sessions and processes read while one of them writes.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _query(self, sql, params=()):
+        return self._connect().execute(sql, params).fetchall()
+
+    def _tags(self, table, key, ids):
+        tags = {record_id: [] for record_id in ids}
+        if not ids:
+            return tags
+        placeholders = ",".join("?" * len(ids))
+        for row in self._query(f"SELECT {key}, tag FROM {table} WHERE {key} IN ({placeholders})", ids):
+            tags[row[0]].append(row[1])
+        return tags
+
+    # Documents
+
+    def _documents(self, rows):
+        documents = [dict(row) for row in rows]
+        tags = self._tags("document_tags", "doc_id", [doc['id'] for doc in documents])
+        for doc in documents:
+            doc['tags'] = tags[doc['id']]
+        return documents
+
+    def save_document(self, document):
+        """Insert a document, or replace the record with the same id."""
+        self.save_documents([document])
+
+    def save_documents(self, documents):
+        """Insert or replace many documents in one transaction."""
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO documents ({', '.join(DOCUMENT_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [[document.get(column) for column in DOCUMENT_COLUMNS] for document in documents],
+            )
+            conn.executemany(
+                "DELETE FROM document_tags WHERE doc_id = ?", [(document['id'],) for document in documents]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO document_tags (doc_id, tag) VALUES (?, ?)",
+                [(document['id'], tag) for document in documents for tag in document.get('tags', [])],
+            )
+
+    def get_document(self, doc_id):
+        documents = self._documents(self._query("SELECT * FROM documents WHERE id = ?", (doc_id,)))
+        return documents[0] if documents else None
+
+    def find_document_by_title(self, title):
+        documents = self._documents(self._query("SELECT * FROM documents WHERE title = ? LIMIT 1", (title,)))
+        return documents[0] if documents else None
+
+    def delete_document(self, doc_id):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,)).rowcount > 0
+
+    def list_documents(self, doc_type=None, tag=None, limit=None, tags=None, uploaded_by=None,
+                       date_from=None, date_to=None):
+        """Documents newest first, optionally filtered.
+
+        tags and uploaded_by accept lists (any value matches); date_from and
+        date_to are inclusive "YYYY-MM-DD" bounds on the upload date.
+        """
+        sql = "SELECT d.* FROM documents d"
+        clauses, params = [], []
+        if tag:
+            sql += " JOIN document_tags t ON t.doc_id = d.id"
+            clauses.append("t.tag = ?")
+            params.append(tag)
+        if tags:
+            clauses.append(
+                f"d.id IN (SELECT doc_id FROM document_tags WHERE tag IN ({','.join('?' * len(tags))}))"
+            )
+            params.extend(tags)
+        if doc_type:
+            clauses.append("d.type = ?")
+            params.append(doc_type)
+        if uploaded_by:
+            clauses.append(f"d.uploaded_by IN ({','.join('?' * len(uploaded_by))})")
+            params.extend(uploaded_by)
+        if date_from:
+            clauses.append("d.upload_date >= ?")
+            params.append(str(date_from))
+        if date_to:
+            # Upload dates carry a time of day
+            clauses.append("d.upload_date <= ?")
+            params.append(f"{date_to} 23:59:59")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY d.upload_date DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._documents(self._query(sql, params))
+
+    def list_uploaders(self):
+        return [row[0] for row in self._query(
+            "SELECT DISTINCT uploaded_by FROM documents WHERE uploaded_by IS NOT NULL ORDER BY uploaded_by"
+        )]
+
+    def document_ids(self):
+        return [row[0] for row in self._query("SELECT id FROM documents")]
+
+    def count_documents(self):
+        return self._query("SELECT COUNT(*) FROM documents")[0][0]
+
+    # FAQs
+
+    def _faqs(self, rows):
+        faqs = [dict(row) for row in rows]
+        tags = self._tags("faq_tags", "faq_id", [faq['id'] for faq in faqs])
+        for faq in faqs:
+            faq['tags'] = tags[faq['id']]
+        return faqs
+
+    def save_faq(self, faq):
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO faqs ({', '.join(FAQ_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [faq.get(column) for column in FAQ_COLUMNS],
+            )
+            conn.execute("DELETE FROM faq_tags WHERE faq_id = ?", (faq['id'],))
+            conn.executemany(
+                "INSERT OR IGNORE INTO faq_tags (faq_id, tag) VALUES (?, ?)",
+                [(faq['id'], tag) for tag in faq.get('tags', [])],
+            )
+
+    def list_faqs(self):
+        return self._faqs(self._query("SELECT * FROM faqs ORDER BY created_date"))
+
+    def get_faqs(self, faq_ids):
+        """FAQs by id, in the order given."""
+        faqs = {}
+        for start in range(0, len(faq_ids), 500):
+            batch = faq_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for faq in self._faqs(self._query(f"SELECT * FROM faqs WHERE id IN ({placeholders})", batch)):
+                faqs[faq['id']] = faq
+        return [faqs[faq_id] for faq_id in faq_ids if faq_id in faqs]
+
+    def upvote_faq(self, faq_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE faqs SET upvotes = upvotes + 1 WHERE id = ?", (faq_id,))
+
+    def count_faqs(self):
+        return self._query("SELECT COUNT(*) FROM faqs")[0][0]
+
+    # Handovers
+
+    def _handovers(self, rows):
+        handovers = []
+        for row in rows:
+            handover = dict(row)
+            handover['projects'] = json.loads(handover['projects'])
+            handover['sections'] = json.loads(handover['sections'])
+            handovers.append(handover)
+        return handovers
+
+    def save_handover(self, handover):
+        values = dict(handover, projects=json.dumps(handover['projects']), sections=json.dumps(handover['sections']))
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO handovers ({', '.join(HANDOVER_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [values[column] for column in HANDOVER_COLUMNS],
+            )
+
+    def list_handovers(self):
+        return self._handovers(self._query("SELECT * FROM handovers ORDER BY created_date"))
+
+    def handovers_due_by(self, last_working_day):
+        """Handovers whose last working day is on or before the given YYYY-MM-DD date."""
+        return self._handovers(self._query(
+            "SELECT * FROM handovers WHERE last_working_day <= ? ORDER BY last_working_day", (last_working_day,)
+        ))
+
+    def count_handovers(self, status=None):
+        if status:
+            return self._query("SELECT COUNT(*) FROM handovers WHERE status = ?", (status,))[0][0]
+        return self._query("SELECT COUNT(*) FROM handovers")[0][0]
+
+    # Ingestion jobs
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def enqueue_ingestion(self, doc_id):
+        """Queue a document for (re-)indexing; a re-upload resets its job."""
+        now = self._now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ingestion_jobs (doc_id, status, error, enqueued_at, updated_at) "
+                "VALUES (?, ?, NULL, ?, ?)",
+                (doc_id, JOB_QUEUED, now, now),
+            )
+
+    def record_ingestion(self, doc_ids, status, error=None):
+        """Record the outcome for documents ingested outside the queue (bulk import)."""
+        now = self._now()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ingestion_jobs (doc_id, status, error, enqueued_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(doc_id, status, error, now, now) for doc_id in doc_ids],
+            )
+
+    def claim_ingestion_job(self):
+        """Atomically move the oldest queued job to extracting.
+
+        Returns (doc_id, enqueued_at), or None when the queue is empty.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT doc_id, enqueued_at FROM ingestion_jobs WHERE status = ? ORDER BY enqueued_at LIMIT 1",
+                (JOB_QUEUED,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE ingestion_jobs SET status = ?, updated_at = ? WHERE doc_id = ?",
+                    (JOB_EXTRACTING, self._now(), row[0]),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return tuple(row) if row is not None else None
+
+    def set_ingestion_status(self, doc_id, status, error=None, enqueued_at=None):
+        """Update a job; with enqueued_at, only if it has not been re-queued since."""
+        sql = "UPDATE ingestion_jobs SET status = ?, error = ?, updated_at = ? WHERE doc_id = ?"
+        params = [status, error, self._now(), doc_id]
+        if enqueued_at is not None:
+            sql += " AND enqueued_at = ?"
+            params.append(enqueued_at)
+        with self._connect() as conn:
+            conn.execute(sql, params)
+
+    def requeue_interrupted_jobs(self):
+        """Put jobs that were mid-flight when the workers stopped back in the queue."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE ingestion_jobs SET status = ?, updated_at = ? WHERE status IN (?, ?)",
+                (JOB_QUEUED, self._now(), JOB_EXTRACTING, JOB_EMBEDDING),
+            ).rowcount
+
+    def ingestion_statuses(self, doc_ids):
+        """Return {doc_id: job dict} for the documents that have a job."""
+        jobs = {}
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for row in self._query(f"SELECT * FROM ingestion_jobs WHERE doc_id IN ({placeholders})", batch):
+                jobs[row['doc_id']] = dict(row)
+        return jobs
+
+    def active_ingestion_jobs(self):
+        placeholders = ",".join("?" * len(JOB_ACTIVE_STATUSES))
+        rows = self._query(
+            f"SELECT j.*, d.title FROM ingestion_jobs j JOIN documents d ON d.id = j.doc_id "
+            f"WHERE j.status IN ({placeholders}) ORDER BY j.enqueued_at",
+            JOB_ACTIVE_STATUSES,
+        )
+        return [dict(row) for row in rows]
+
+    # Podcast jobs
+
+    def enqueue_podcast(self, job_id, title):
+        """Queue a podcast; a failed job with the same id starts over."""
+        now = self._now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO podcast_jobs "
+                "(id, title, status, segments_done, segments_total, error, enqueued_at, updated_at) "
+                "VALUES (?, ?, ?, 0, NULL, NULL, ?, ?)",
+                (job_id, title, JOB_QUEUED, now, now),
+            )
+
+    def claim_podcast_job(self):
+        """Atomically move the oldest queued podcast to synthesizing; returns its id or None."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM podcast_jobs WHERE status = ? ORDER BY enqueued_at LIMIT 1", (JOB_QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE podcast_jobs SET status = ?, updated_at = ? WHERE id = ?",
+                    (PODCAST_SYNTHESIZING, self._now(), row[0]),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return row[0] if row is not None else None
+
+    def set_podcast_progress(self, job_id, segments_done, segments_total):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE podcast_jobs SET segments_done = ?, segments_total = ?, updated_at = ? WHERE id = ?",
+                (segments_done, segments_total, self._now(), job_id),
+            )
+
+    def set_podcast_status(self, job_id, status, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE podcast_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, self._now(), job_id),
+            )
+
+    def get_podcast_job(self, job_id):
+        rows = self._query("SELECT * FROM podcast_jobs WHERE id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    def requeue_interrupted_podcasts(self):
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE podcast_jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (JOB_QUEUED, self._now(), PODCAST_SYNTHESIZING),
+            ).rowcount
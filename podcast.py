@@ -0,0 +1,405 @@
+import array
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import re
+import tempfile
+import textwrap
+import threading
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from audio_encoding import PODCAST_AUDIO_FORMAT, PODCAST_BITRATE_KBPS, encode_audio, find_encoded
+from ingestion import iter_pdf_pages
+from metadata_store import JOB_FAILED, PODCAST_READY
+from wav_audio import wav_format, write_wav
+
+PODCAST_WORKERS = 1
+# Processes synthesizing segments, each with its own TTS engine
+TTS_WORKERS = os.cpu_count() or 1
+# Characters synthesized as one unit
+PODCAST_SEGMENT_WIDTH = 500
+# Chapter sizes in characters (about 1,000 characters per minute of speech).
+# Sections shorter than the minimum are merged into the one before; longer
+# than the maximum are split at a page boundary. Documents without headings
+# are split at the first page boundary past the target.
+CHAPTER_MIN_CHARS = 1500
+CHAPTER_TARGET_CHARS = 8000
+CHAPTER_MAX_CHARS = 24000
+# Bump when the audio produced for the same PDF changes, so old jobs are not reused
+PODCAST_FORMAT_VERSION = 3
+# Uploads are hashed and copied to disk in blocks of this size
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# "3 Scope", "2.1 Handover steps", "Chapter 4", "Section B: Access"
+HEADING_PATTERN = re.compile(r"^(?:(?i:chapter|section|part|appendix)\s+\w+|\d+(?:\.\d+)*\.?\s+[A-Z])")
+
+
+def is_heading(line):
+    if not 3 <= len(line) <= 80 or line.endswith((".", ",", ";")):
+        return False
+    if HEADING_PATTERN.match(line):
+        return True
+    letters = sum(1 for c in line if c.isalpha())
+    return letters >= 4 and line.isupper()
+
+
+def split_chapters(pages):
+    """Split a document's page texts into chapters.
+
+    Returns [{'title', 'page', 'text'}] in document order, split at section
+    headings when the document has them and at page boundaries otherwise.
+    """
+    lines = [
+        (number, line.strip())
+        for number, page in enumerate(pages, start=1)
+        for line in (page or "").splitlines() if line.strip()
+    ]
+    by_heading = sum(1 for _, line in lines if is_heading(line)) >= 2
+    chapters = []
+    previous_page = None
+    for number, line in lines:
+        new_page = number != previous_page
+        previous_page = number
+        if not chapters:
+            title = line if by_heading and is_heading(line) else ("Introduction" if by_heading else None)
+        elif by_heading and is_heading(line) and chapters[-1]['chars'] >= CHAPTER_MIN_CHARS:
+            title = line
+        elif new_page and chapters[-1]['chars'] >= (CHAPTER_MAX_CHARS if by_heading else CHAPTER_TARGET_CHARS):
+            title = f"{chapters[-1]['section']} (continued)" if by_heading else None
+        else:
+            chapters[-1]['lines'].append(line)
+            chapters[-1]['chars'] += len(line) + 1
+            chapters[-1]['last_page'] = number
+            continue
+        section = chapters[-1]['section'] if title and title.endswith(" (continued)") else title
+        chapters.append({
+            'title': title, 'section': section, 'page': number, 'last_page': number,
+            'lines': [line], 'chars': len(line) + 1,
+        })
+    for chapter in chapters:
+        if chapter['title'] is None:
+            first, last = chapter['page'], chapter['last_page']
+            chapter['title'] = f"Page {first}" if first == last else f"Pages {first}-{last}"
+    return [
+        {'title': chapter['title'], 'page': chapter['page'], 'text': " ".join(chapter['lines'])}
+        for chapter in chapters
+    ]
+
+
+class Pyttsx3Synthesizer:
+    """System text-to-speech. An engine must stay on the thread that created it."""
+
+    name = "pyttsx3"
+
+    def __init__(self):
+        import pyttsx3
+
+        self.engine = pyttsx3.init()
+        self.voices = self.engine.getProperty('voices')
+
+    def synthesize(self, text, index, path):
+        # Alternate two voices and speeds, like a two-host show
+        if self.voices and len(self.voices) > 1:
+            self.engine.setProperty('voice', self.voices[index % 2].id)
+        self.engine.setProperty('rate', 180 if index % 2 == 0 else 160)
+        self.engine.save_to_file(text, path)
+        self.engine.runAndWait()
+
+
+class StubSynthesizer:
+    """Stand-in for machines without a speech backend: one short tone per word.
+
+    The audio is timed like speech at the same rates, so the rest of the
+    pipeline (progress, assembly, playback) can be developed and tested.
+    """
+
+    name = "stub"
+    sample_rate = 16000
+
+    def synthesize(self, text, index, path):
+        words_per_second = (180 if index % 2 == 0 else 160) / 60
+        pitch = 220 if index % 2 == 0 else 165
+        word = int(self.sample_rate / words_per_second)
+        tone = int(word * 0.6)
+        samples = array.array('h', [
+            int(3000 * math.sin(2 * math.pi * pitch * n / self.sample_rate)) if n < tone else 0
+            for n in range(word)
+        ])
+        with wave.open(path, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.sample_rate)
+            out.writeframes(samples.tobytes() * len(text.split()))
+
+
+_synthesizer = None
+_tts_pool = None
+_tts_pool_lock = threading.Lock()
+
+
+def _init_tts_worker():
+    """Runs once in each pool process: give it its own engine."""
+    global _synthesizer
+    try:
+        _synthesizer = Pyttsx3Synthesizer()
+    except Exception:
+        _synthesizer = StubSynthesizer()
+
+
+def synthesize_segment(text, index, path):
+    """Runs in a pool process; writes one segment and returns the synthesizer used."""
+    partial = path + ".part.wav"
+    _synthesizer.synthesize(text, index, partial)
+    os.replace(partial, path)
+    return _synthesizer.name
+
+
+def get_tts_pool():
+    """Process pool shared by every podcast job in this process."""
+    global _tts_pool
+    with _tts_pool_lock:
+        if _tts_pool is None:
+            # spawn, not fork: the Streamlit server is multi-threaded
+            _tts_pool = ProcessPoolExecutor(
+                max_workers=TTS_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_tts_worker,
+            )
+        return _tts_pool
+
+
+class PodcastJobs:
+    """Background threads that turn uploaded PDFs into podcasts.
+
+    A job's id is the hash of the PDF, so uploading or linking to the same
+    file again reuses the finished audio. Jobs live in the metadata store
+    and each segment is kept on disk as it is synthesized, so a restart
+    resumes where it stopped. Segments are synthesized in parallel across
+    the TTS process pool.
+
+    Long documents become chaptered podcasts: each chapter's audio and its
+    entry in chapters.json are written as soon as its last segment is done,
+    and the whole podcast joins the chapters once all of them are. What is
+    delivered is compressed (see audio_encoding.py); the WAV files are
+    only kept to assemble and resume from, and deleted once it is ready.
+    """
+
+    def __init__(self, store, directory, workers=PODCAST_WORKERS, poll_interval=1.0,
+                 audio_format=PODCAST_AUDIO_FORMAT, bitrate=PODCAST_BITRATE_KBPS):
+        self.store = store
+        self.directory = directory
+        self.audio_format = audio_format
+        self.bitrate = bitrate
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self.store.requeue_interrupted_podcasts()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"podcast-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def audio_file(self, job_id):
+        """(path, mime_type) of the finished, compressed podcast, or None."""
+        return find_encoded(os.path.join(self.job_dir(job_id), "podcast"))
+
+    def transcript_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), "transcript.txt")
+
+    def submit(self, fileobj, title):
+        """Queue a podcast for an uploaded PDF and return its job id.
+
+        An upload that is already queued, in progress or done is not
+        synthesized again.
+        """
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".pdf", delete=False) as tmp:
+            for block in iter(lambda: fileobj.read(COPY_BLOCK_SIZE), b""):
+                digest.update(block)
+                tmp.write(block)
+        digest.update(f"format {PODCAST_FORMAT_VERSION} {self.audio_format} {self.bitrate}".encode('ascii'))
+        job_id = digest.hexdigest()[:32]
+        job = self.store.get_podcast_job(job_id)
+        if job is not None and job['status'] != JOB_FAILED:
+            os.remove(tmp.name)
+            return job_id
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        os.replace(tmp.name, os.path.join(self.job_dir(job_id), "source.pdf"))
+        self.store.enqueue_podcast(job_id, title)
+        self._wakeup.set()
+        return job_id
+
+    def _run(self):
+        while not self._stop.is_set():
+            job_id = self.store.claim_podcast_job()
+            if job_id is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self.process(job_id)
+            except Exception as e:
+                self.store.set_podcast_status(job_id, JOB_FAILED, str(e))
+
+    def chapters_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), "chapters.json")
+
+    def chapter_path(self, job_id, number):
+        return os.path.join(self.job_dir(job_id), f"chapter_{number:03d}.wav")
+
+    def chapter_index(self, job_id):
+        """The job's chapters so far.
+
+        [{'number', 'title', 'page', 'segments', 'ready', 'failed', 'duration', 'start', 'file', 'mime'}]
+        where file is the compressed audio's name in the job directory and
+        failed is set when none of the chapter's segments could be synthesized.
+        """
+        try:
+            with open(self.chapters_path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save_chapter_index(self, job_id, chapters):
+        partial = self.chapters_path(job_id) + ".part"
+        with open(partial, "w", encoding='utf-8') as f:
+            json.dump(chapters, f, indent=1)
+        os.replace(partial, self.chapters_path(job_id))
+
+    def _finish_chapter(self, job_id, chapter, parts):
+        """Assemble a chapter whose segments are all done; it is playable from then on."""
+        parts = [part for part in parts if os.path.exists(part)]
+        # Every segment failed: the chapter is done, but has no audio
+        chapter['failed'] = not parts
+        if parts:
+            path = self.chapter_path(job_id, chapter['number'])
+            with open(path + ".part", "wb") as out:
+                write_wav(parts, out)
+            os.replace(path + ".part", path)
+            self._encode_chapter(job_id, chapter)
+        for part in parts:
+            os.remove(part)
+
+    def _encode_chapter(self, job_id, chapter):
+        path = self.chapter_path(job_id, chapter['number'])
+        encoded, mime, encoder = encode_audio([path], os.path.splitext(path)[0], self.audio_format, self.bitrate)
+        channels, width, rate, frames = wav_format(path)
+        chapter.update(ready=True, duration=frames / rate, file=os.path.basename(encoded), mime=mime)
+
+    def process(self, job_id):
+        job_dir = self.job_dir(job_id)
+        pages = list(iter_pdf_pages(os.path.join(job_dir, "source.pdf")))
+        text = "\n".join(page for page in pages if page)
+        if not text.strip():
+            raise ValueError("No text found in PDF")
+        with open(self.transcript_path(job_id), "w", encoding='utf-8') as f:
+            f.write(text)
+
+        # Segments are numbered across the whole document; a chapter whose
+        # audio exists was finished by an earlier run and is kept
+        chapters, segments, owner = [], [], []
+        for number, chapter in enumerate(split_chapters(pages), start=1):
+            texts = textwrap.wrap(chapter['text'], width=PODCAST_SEGMENT_WIDTH)
+            chapters.append({
+                'number': number, 'title': chapter['title'], 'page': chapter['page'], 'segments': len(texts),
+                'ready': False, 'failed': False, 'duration': None, 'start': None, 'file': None, 'mime': None,
+            })
+            if os.path.exists(self.chapter_path(job_id, number)):
+                encoded = find_encoded(os.path.splitext(self.chapter_path(job_id, number))[0])
+                if encoded is None:
+                    self._encode_chapter(job_id, chapters[-1])
+                else:
+                    channels, width, rate, frames = wav_format(self.chapter_path(job_id, number))
+                    chapters[-1].update(
+                        ready=True, duration=frames / rate, file=os.path.basename(encoded[0]), mime=encoded[1]
+                    )
+            segments.extend(texts)
+            owner.extend([number - 1] * len(texts))
+        self._save_chapter_index(job_id, chapters)
+
+        parts = [os.path.join(job_dir, f"segment_{i:05d}.wav") for i in range(len(segments))]
+        chapter_parts = [[] for _ in chapters]
+        for i, chapter in enumerate(owner):
+            chapter_parts[chapter].append(parts[i])
+        pending = [
+            0 if chapter['ready'] else sum(1 for part in chapter_parts[n] if not os.path.exists(part))
+            for n, chapter in enumerate(chapters)
+        ]
+        done = len(segments) - sum(pending)
+        self.store.set_podcast_progress(job_id, done, len(segments))
+        # Chapters left complete by an interrupted run
+        for n, chapter in enumerate(chapters):
+            if not chapter['ready'] and pending[n] == 0:
+                self._finish_chapter(job_id, chapter, chapter_parts[n])
+        self._save_chapter_index(job_id, chapters)
+
+        # The pool takes segments in submission order, so chapters finish roughly in order
+        pool = get_tts_pool()
+        futures = {
+            pool.submit(synthesize_segment, segments[i], i, parts[i]): i
+            for i in range(len(segments))
+            if not chapters[owner[i]]['ready'] and not os.path.exists(parts[i])
+        }
+        skipped, synthesizers = [], set()
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    synthesizers.add(future.result())
+                except Exception as e:
+                    skipped.append(f"segment {i} ({e})")
+                done += 1
+                pending[owner[i]] -= 1
+                if pending[owner[i]] == 0:
+                    self._finish_chapter(job_id, chapters[owner[i]], chapter_parts[owner[i]])
+                    self._save_chapter_index(job_id, chapters)
+                self.store.set_podcast_progress(job_id, done, len(segments))
+        finally:
+            for future in futures:
+                future.cancel()
+
+        # The whole podcast, chapters in document order
+        ready = [chapter for chapter in chapters if chapter['ready']]
+        if not ready:
+            raise RuntimeError("No audio was generated" + (f": {skipped[0]}" if skipped else ""))
+        start = 0.0
+        for chapter in ready:
+            chapter['start'] = start
+            start += chapter['duration']
+        path, mime, encoder = encode_audio(
+            [self.chapter_path(job_id, chapter['number']) for chapter in ready],
+            os.path.join(job_dir, "podcast"), self.audio_format, self.bitrate,
+        )
+        self._save_chapter_index(job_id, chapters)
+
+        warnings = []
+        if skipped:
+            warnings.append(f"Skipped {len(skipped)} of {len(segments)} segments, e.g. {skipped[0]}")
+        if StubSynthesizer.name in synthesizers:
+            warnings.append("No speech backend on the server; placeholder tones were used instead of speech")
+        if encoder == "mulaw" and self.audio_format != "mulaw":
+            warnings.append("No Opus or MP3 encoder on the server; the audio is mu-law WAV, which is larger")
+        self.store.set_podcast_status(job_id, PODCAST_READY, ". ".join(warnings) or None)
+
+        # Everything is encoded: the PCM intermediates are no longer needed
+        leftovers = [self.chapter_path(job_id, chapter['number']) for chapter in chapters]
+        leftovers += [path for part in parts for path in (part, part + ".part.wav")]
+        for path in leftovers:
+            if os.path.exists(path):
+                os.remove(path)
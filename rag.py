@@ -0,0 +1,107 @@
+import time
+
+from llm_backends import MAX_NEW_TOKENS
+
+# Documents retrieved per question, and excerpts taken from each
+RAG_DOCUMENTS = 4
+RAG_CHUNKS_PER_DOCUMENT = 2
+# Most prompt tokens spent on excerpts; the instruction and question come on top
+CONTEXT_TOKEN_BUDGET = 1500
+
+PROMPT_TEMPLATE = """[INST] As a knowledge management consultant, provide 3-5 actionable recommendations for:
+{question}
+
+Use bullet points and professional language. Focus on knowledge continuity and transfer.{context} [/INST]"""
+
+CONTEXT_HEADER = """
+Ground the recommendations in these excerpts from our knowledge base where relevant, citing them by number:
+
+"""
+
+
+def truncate_to_tokens(text, max_tokens, count_tokens):
+    """Cut text down to at most max_tokens, at a word boundary."""
+    tokens = count_tokens(text)
+    while tokens > max_tokens and text:
+        text = text[:int(len(text) * max_tokens / tokens * 0.95)]
+        text = text[:text.rfind(" ")] if " " in text else text
+        tokens = count_tokens(text)
+    return text
+
+
+def build_prompt(question, chunks, count_tokens, budget=CONTEXT_TOKEN_BUDGET):
+    """Return (prompt, sources) with as many excerpts as fit in the token budget.
+
+    chunks are in rank order; the last one that fits only partly is cut short.
+    """
+    excerpts, sources = [], []
+    remaining = budget
+    for chunk in chunks:
+        page = f", page {chunk.metadata['page']}" if chunk.metadata.get('page') else ""
+        heading = f"[{len(excerpts) + 1}] {chunk.metadata['source']} ({chunk.metadata['type']}{page})\n"
+        available = remaining - count_tokens(heading)
+        if available < 32:
+            break
+        text = truncate_to_tokens(chunk.page_content.strip(), available, count_tokens)
+        excerpts.append(heading + text)
+        sources.append({'number': len(excerpts), 'source': chunk.metadata['source'], 'page': chunk.metadata.get('page')})
+        remaining -= count_tokens(excerpts[-1])
+    context = CONTEXT_HEADER + "\n\n".join(excerpts) if excerpts else ""
+    return PROMPT_TEMPLATE.format(question=question, context=context), sources
+
+
+class RagAnswer:
+    """One answer being generated; stream() yields text as it arrives.
+
+    Timings are filled in while streaming: retrieval_seconds up front,
+    first_token_seconds at the first piece of text (measured from the
+    start of retrieval) and total_seconds at the end.
+    """
+
+    def __init__(self, prompt, sources, backend, started, retrieval_seconds, max_new_tokens):
+        self.prompt = prompt
+        self.sources = sources
+        self.backend = backend
+        self.prompt_tokens = backend.count_tokens(prompt)
+        self.max_new_tokens = max_new_tokens
+        self.started = started
+        self.retrieval_seconds = retrieval_seconds
+        self.first_token_seconds = None
+        self.total_seconds = None
+        self.text = ""
+
+    def stream(self):
+        for piece in self.backend.stream(self.prompt, self.max_new_tokens):
+            if self.first_token_seconds is None:
+                self.first_token_seconds = time.perf_counter() - self.started
+            self.text += piece
+            yield piece
+        self.total_seconds = time.perf_counter() - self.started
+
+
+class RagPipeline:
+    """Retrieves excerpts from the knowledge index and asks the LLM backend."""
+
+    def __init__(self, index, backend, documents=RAG_DOCUMENTS, chunks_per_document=RAG_CHUNKS_PER_DOCUMENT,
+                 context_budget=CONTEXT_TOKEN_BUDGET, max_new_tokens=MAX_NEW_TOKENS):
+        self.index = index
+        self.backend = backend
+        self.documents = documents
+        self.chunks_per_document = chunks_per_document
+        self.context_budget = context_budget
+        self.max_new_tokens = max_new_tokens
+
+    def ask(self, question):
+        started = time.perf_counter()
+        chunks = []
+        if self.index is not None and len(self.index):
+            for result in self.index.search_documents(
+                question, k=self.documents, chunks_per_document=self.chunks_per_document
+            ):
+                chunks.extend(result['chunks'])
+        # Never let excerpts crowd out the answer in a small context window
+        budget = min(self.context_budget, self.backend.context_tokens - self.max_new_tokens - 256)
+        prompt, sources = build_prompt(question, chunks, self.backend.count_tokens, budget)
+        return RagAnswer(
+            prompt, sources, self.backend, started, time.perf_counter() - started, self.max_new_tokens
+        )
@@ -0,0 +1,117 @@
+"""Local stand-in for a llama.cpp server, for developing the AI features offline.
+
+    python stub_llm_server.py --port 8080 --token-delay 0.02
+    python stub_llm_server.py --port 8080 --error-rate 0.3   # exercise retries and the circuit breaker
+    KP_LLM_BACKEND=server streamlit run KnowledgeApp_v2.py
+
+Answers POST /completion with canned recommendations that name the source
+documents found in the prompt, streamed word by word as server-sent events
+in llama.cpp's format.
+"""
+import argparse
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ANSWER = [
+    "Document the critical processes and decisions while the people who know them are still available.",
+    "Pair each knowledge holder with a backup and schedule regular handover sessions.",
+    "Keep the knowledge base current: review stale documents every quarter.",
+    "Record short walkthroughs of the systems that are hardest to learn.",
+]
+
+
+def stub_answer(prompt):
+    sources = re.findall(r"^\[\d+\] (.+?) \(", prompt, flags=re.MULTILINE)
+    lines = [f"- {line}" for line in CANNED_ANSWER]
+    if sources:
+        lines.append("- Start from: " + ", ".join(dict.fromkeys(sources)))
+    return "\n".join(lines)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    token_delay = 0.02
+    first_token_delay = 0.2
+    # Share of completion requests answered with 503, to test the client
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            # The client stopped reading, e.g. after the final event
+            pass
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json({'status': "ok"})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path != "/completion":
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+        if 'prompt' not in request:
+            # llama.cpp rejects a request without a prompt the same way
+            self.send_error(400, "\"prompt\" must be provided")
+            return
+        if random.random() < self.error_rate:
+            self.send_error(503, "Simulated overload")
+            return
+        words = stub_answer(request.get('prompt', "")).split(" ")[:request.get('n_predict', 512)]
+        if not request.get('stream'):
+            time.sleep(self.first_token_delay + self.token_delay * len(words))
+            self._send_json({'content': " ".join(words), 'stop': True})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(self.first_token_delay)
+        for n, word in enumerate(words):
+            self._send_event({'content': word if n == 0 else " " + word, 'stop': False})
+            time.sleep(self.token_delay)
+        self._send_event({'content': "", 'stop': True})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_event(self, event):
+        data = f"data: {json.dumps(event)}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub llama.cpp-style completion server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--token-delay", type=float, default=StubHandler.token_delay, help="seconds per token")
+    parser.add_argument("--first-token-delay", type=float, default=StubHandler.first_token_delay)
+    parser.add_argument("--error-rate", type=float, default=StubHandler.error_rate, help="share of requests failing with 503")
+    args = parser.parse_args()
+    StubHandler.token_delay = args.token_delay
+    StubHandler.first_token_delay = args.first_token_delay
+    StubHandler.error_rate = args.error_rate
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub LLM server on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
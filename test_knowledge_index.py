@@ -0,0 +1,77 @@
+"""Regression tests for KnowledgeIndex persistence and search paging.
+
+    python -m pytest test_knowledge_index.py
+"""
+import hashlib
+
+import pytest
+from langchain.embeddings.base import Embeddings
+
+from knowledge_index import KnowledgeIndex
+
+DIMENSION = 32
+
+
+class HashEmbeddings(Embeddings):
+    """Bag-of-words vectors; deterministic and fast, no model download."""
+
+    def _vector(self, text):
+        vector = [0.0] * DIMENSION
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % DIMENSION] += 1
+        return vector
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def make_document(number, text):
+    return {'id': f"doc-{number}", 'title': f"Document {number}", 'type': "Other", 'content': text}
+
+
+def open_index(path, **options):
+    index = KnowledgeIndex(embeddings=HashEmbeddings(), index_dir=str(path), **options)
+    assert index.load() is None
+    return index
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_reopen_after_unsnapshotted_delete(tmp_path, index_type):
+    index = open_index(tmp_path, index_type=index_type)
+    index.add_documents([
+        make_document(number, f"handover notes {number} " + " ".join(f"term{number}x{n}" for n in range(300)))
+        for number in range(20)
+    ])
+    index.compact()
+    # Journaled only, as after a crash before the next snapshot
+    assert index.remove_document("doc-3")
+
+    reopened = open_index(tmp_path, index_type=index_type)
+    assert "doc-3" not in reopened
+    assert len(reopened) == 19
+    hits = reopened.search("handover notes 7 term7x1", k=3)
+    assert hits and hits[0][0].metadata['doc_id'] == "doc-7"
+    assert all(chunk.metadata['doc_id'] != "doc-3" for chunk, _ in reopened.search("term3x1 term3x2", k=10))
+
+
+@pytest.mark.parametrize("mode", ["keyword", "semantic", "hybrid"])
+def test_pages_are_full_when_one_document_dominates(tmp_path, mode):
+    index = open_index(tmp_path)
+    # Dozens of chunks of one document match better than any other document
+    long_document = dict(make_document(0, ""), pages=["rotation schedule"] * 40)
+    index.add_documents(
+        [long_document]
+        + [make_document(number, f"rotation schedule for team {number} " + "filler " * 40) for number in range(1, 6)]
+    )
+    # The portal asks for k + 1 documents to tell whether there is a next page
+    first = index.search_documents("rotation schedule", k=3, offset=0, mode=mode)
+    second = index.search_documents("rotation schedule", k=3, offset=2, mode=mode)
+    assert len(first) == 3
+    assert len(second) == 3
+    last = index.search_documents("rotation schedule", k=3, offset=4, mode=mode)
+    assert first[0]['doc_id'] == "doc-0"
+    pages = [group['doc_id'] for group in first[:2] + second[:2] + last]
+    assert sorted(pages) == [f"doc-{number}" for number in range(6)]
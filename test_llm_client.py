@@ -0,0 +1,118 @@
+"""Regression tests for the LLM client's circuit breaker, run against the stub server.
+
+    python -m pytest test_llm_client.py
+"""
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+
+from llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMClientError
+from stub_llm_server import StubHandler
+
+
+@pytest.fixture
+def stub_server():
+    handler = type("TestStubHandler", (StubHandler,), {'token_delay': 0, 'first_token_delay': 0})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, reset_seconds=0.1):
+    host, port = server.server_address
+    breaker = CircuitBreaker(failures=2, reset_seconds=reset_seconds)
+    return LLMClient(f"http://{host}:{port}", retries=0, deadline=5, breaker=breaker)
+
+
+def open_breaker(server, client):
+    server.RequestHandlerClass.error_rate = 1.0
+    for _ in range(2):
+        with pytest.raises(LLMClientError):
+            client.post_json("/completion", {'prompt': "hi"})
+    server.RequestHandlerClass.error_rate = 0.0
+    assert client.breaker.state == "open"
+    time.sleep(client.breaker.reset_seconds)
+    assert client.breaker.state == "half-open"
+
+
+def test_client_error_on_trial_closes_breaker(stub_server):
+    client = make_client(stub_server)
+    open_breaker(stub_server, client)
+    # 400: the server answered, so it is reachable again
+    with pytest.raises(LLMClientError) as raised:
+        client.post_json("/completion", {'n_predict': 4})
+    assert not isinstance(raised.value, CircuitOpenError)
+    assert client.breaker.state == "closed"
+    assert client.post_json("/completion", {'prompt': "hi"})['stop']
+
+
+def test_trial_without_verdict_is_released(stub_server):
+    client = make_client(stub_server)
+    open_breaker(stub_server, client)
+    # The deadline runs out before the trial request is even sent
+    with pytest.raises(LLMClientError):
+        client.post_json("/completion", {'prompt': "hi"}, deadline=-1)
+    assert client.breaker.state == "half-open"
+    assert client.post_json("/completion", {'prompt': "hi"})['stop']
+    assert client.breaker.state == "closed"
+
+
+def test_streaming_recovers_after_half_open_trial(stub_server):
+    client = make_client(stub_server)
+    open_breaker(stub_server, client)
+    events = list(client.stream_events("/completion", {'prompt': "hi", 'stream': True, 'n_predict': 3}))
+    assert events[-1]['stop']
+    assert client.breaker.state == "closed"
+
+
+def test_closed_attempt_does_not_free_the_trial_of_another_thread(stub_server):
+    client = make_client(stub_server)
+    post = client.session.post
+    started = {name: threading.Event() for name in ("early", "trial")}
+    finish = {name: threading.Event() for name in ("early", "trial")}
+
+    def blocking_post(*args, **kwargs):
+        name = threading.current_thread().name
+        if name in started:
+            started[name].set()
+            finish[name].wait(5)
+            if name == "early":
+                # Ends without a verdict on the server
+                raise requests.exceptions.InvalidHeader("broken header")
+        return post(*args, **kwargs)
+
+    client.session.post = blocking_post
+    errors = {}
+
+    def call(name):
+        try:
+            client.post_json("/completion", {'prompt': "hi"})
+        except Exception as e:
+            errors[name] = e
+
+    # Admitted while the breaker is still closed
+    early = threading.Thread(target=call, args=("early",), name="early")
+    early.start()
+    started["early"].wait(5)
+    open_breaker(stub_server, client)
+    trial = threading.Thread(target=call, args=("trial",), name="trial")
+    trial.start()
+    started["trial"].wait(5)
+
+    finish["early"].set()
+    early.join(5)
+    assert isinstance(errors.get("early"), requests.exceptions.InvalidHeader)
+    # The probe is still in flight, so nobody else may call the server
+    with pytest.raises(CircuitOpenError):
+        client.post_json("/completion", {'prompt': "hi"})
+
+    finish["trial"].set()
+    trial.join(5)
+    assert "trial" not in errors
+    assert client.breaker.state == "closed"
@@ -0,0 +1,514 @@
+"""FAISS vector index with selectable structure: flat, IVF or HNSW.
+
+Flat is an exact scan and the right choice for small corpora. IVF clusters
+the vectors around trained centroids and only scans the nprobe closest
+clusters; HNSW walks a proximity graph. With index_type="auto" the
+structure follows the vector count and is converted on the next write when
+the corpus crosses a threshold.
+
+Vectors can also be quantized in RAM: int8 scalar quantization ("sq8", 4x
+smaller) or product quantization ("pq", 16x smaller for 384 dimensions).
+The nearest candidates are then re-ranked with exact distances to the
+full-precision vectors, which stay on disk and are read only for them.
+
+Searches can be restricted by chunk attributes (type, tags, uploader,
+upload date). Each attribute value keeps a bitmap of the labels that carry
+it; a filter combines them into one bitmap that FAISS checks while it
+searches, and very selective filters are scored exactly instead.
+
+To choose settings, compare recall and latency against the exact baseline
+on the saved index:
+
+    python vector_index.py --report
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import pickle
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("auto", "flat", "ivf", "hnsw")
+QUANTIZATIONS = (None, "sq8", "pq")
+# Auto selection: exact search up to HNSW_MIN_VECTORS, HNSW up to
+# IVF_MIN_VECTORS, IVF beyond (HNSW's graph costs ~2*M ids per vector in RAM)
+HNSW_MIN_VECTORS = 20_000
+IVF_MIN_VECTORS = 1_000_000
+# A structure is only downgraded once the corpus shrinks well below its
+# threshold, so deletions around a boundary do not convert back and forth
+AUTO_DOWNGRADE_RATIO = 0.5
+
+# IVF: centroids ~4*sqrt(n); FAISS wants ~39 training points per centroid
+IVF_NPROBE = 16
+IVF_MIN_TRAINING_POINTS = 39
+# Centroids and quantizers are retrained once the corpus has grown this much
+# since training
+RETRAIN_GROWTH = 4
+
+# HNSW: graph degree, build-time and query-time search breadth
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+# HNSW cannot delete in place; removed vectors are masked until they make
+# up this share of the graph, then it is rebuilt without them
+HNSW_MAX_DELETED_RATIO = 0.2
+
+# PQ: bytes per vector (one 8-bit code per sub-vector); 96 keeps 4
+# dimensions per sub-vector for MiniLM's 384
+PQ_M = 96
+# 256 centroids per sub-quantizer need enough points to train; below this
+# PQ falls back to int8 scalar quantization
+PQ_MIN_TRAINING_POINTS = 256 * 39
+# Candidates fetched per requested result before exact re-ranking
+RERANK_FACTOR = 4
+
+# Chunk metadata fields with a bitmap per value; tags is a list per chunk
+FILTER_ATTRIBUTES = ("type", "tags", "uploaded_by", "upload_date")
+# Filters matching at most this many vectors are scored exactly rather than
+# through IVF/HNSW, which can miss the few allowed vectors entirely
+FILTER_EXACT_MAX = 4096
+# Upper bound on how much nprobe/efSearch grow for selective filters
+FILTER_MAX_WIDEN = 8
+
+
+def choose_index_type(count, current=None):
+    """Index structure for a corpus of count vectors."""
+    wanted = "flat"
+    if count >= IVF_MIN_VECTORS:
+        wanted = "ivf"
+    elif count >= HNSW_MIN_VECTORS:
+        wanted = "hnsw"
+    order = ("flat", "hnsw", "ivf")
+    if current in order and order.index(wanted) < order.index(current):
+        threshold = IVF_MIN_VECTORS if current == "ivf" else HNSW_MIN_VECTORS
+        if count >= threshold * AUTO_DOWNGRADE_RATIO:
+            return current
+    return wanted
+
+
+def ivf_nlist(count):
+    return max(1, min(int(4 * math.sqrt(count)), count // IVF_MIN_TRAINING_POINTS))
+
+
+class LabelFilter:
+    """A set of labels held as a little-endian bitmap (FAISS's IDSelectorBitmap layout)."""
+
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+        self.count = int(np.unpackbits(bitmap).sum())
+
+    def __contains__(self, label):
+        byte = label >> 3
+        return 0 <= byte < len(self.bitmap) and bool(self.bitmap[byte] >> (label & 7) & 1)
+
+    def labels(self):
+        return np.flatnonzero(np.unpackbits(self.bitmap, bitorder='little')).astype('int64')
+
+    def selector(self):
+        return faiss.IDSelectorBitmap(len(self.bitmap) * 8, faiss.swig_ptr(self.bitmap))
+
+
+class AttributeBitmaps:
+    """Per-attribute, per-value bitmaps of vector labels."""
+
+    def __init__(self):
+        self.bitmaps = {attribute: {} for attribute in FILTER_ATTRIBUTES}
+        # Sorted upload days, for date-range lookups
+        self.days = []
+        self.size = 0
+
+    @staticmethod
+    def _values(metadata, attribute):
+        value = (metadata or {}).get(attribute)
+        if value is None:
+            return []
+        if attribute == "upload_date":
+            # Bucketed by day: "2024-05-01 10:32:00" -> "2024-05-01"
+            return [value[:10]]
+        return value if isinstance(value, (list, tuple)) else [value]
+
+    def _bitmap(self, attribute, value):
+        bitmap = self.bitmaps[attribute].get(value)
+        if bitmap is None:
+            bitmap = self.bitmaps[attribute][value] = np.zeros(self.size, dtype='uint8')
+            if attribute == "upload_date":
+                bisect.insort(self.days, value)
+        if len(bitmap) < self.size:
+            bitmap = self.bitmaps[attribute][value] = np.concatenate(
+                [bitmap, np.zeros(self.size - len(bitmap), dtype='uint8')]
+            )
+        return bitmap
+
+    def add(self, labels, metadatas):
+        if len(labels):
+            # Grow geometrically so appends stay cheap
+            needed = (int(max(labels)) >> 3) + 1
+            if needed > self.size:
+                self.size = max(needed, self.size * 2)
+        for label, metadata in zip(labels, metadatas):
+            label = int(label)
+            for attribute in FILTER_ATTRIBUTES:
+                for value in self._values(metadata, attribute):
+                    self._bitmap(attribute, value)[label >> 3] |= 1 << (label & 7)
+
+    def remove(self, labels, metadatas):
+        for label, metadata in zip(labels, metadatas):
+            label = int(label)
+            for attribute in FILTER_ATTRIBUTES:
+                for value in self._values(metadata, attribute):
+                    bitmap = self.bitmaps[attribute].get(value)
+                    if bitmap is not None and label >> 3 < len(bitmap):
+                        bitmap[label >> 3] &= ~(1 << (label & 7)) & 0xFF
+
+    def _union(self, attribute, values):
+        combined = np.zeros(self.size, dtype='uint8')
+        for value in values:
+            bitmap = self.bitmaps[attribute].get(value)
+            if bitmap is not None:
+                combined[:len(bitmap)] |= bitmap
+        return combined
+
+    def select(self, filters):
+        """LabelFilter for the labels matching every given predicate, or None for no filter.
+
+        filters maps type, tags and uploaded_by to lists of accepted values
+        (any of them matches), and date_from/date_to to inclusive
+        "YYYY-MM-DD" bounds on the upload date.
+        """
+        combined = None
+        for attribute in ("type", "tags", "uploaded_by"):
+            values = (filters or {}).get(attribute)
+            if values:
+                bitmap = self._union(attribute, values)
+                combined = bitmap if combined is None else combined & bitmap
+        date_from, date_to = (filters or {}).get('date_from'), (filters or {}).get('date_to')
+        if date_from or date_to:
+            start = bisect.bisect_left(self.days, str(date_from)) if date_from else 0
+            stop = bisect.bisect_right(self.days, str(date_to)) if date_to else len(self.days)
+            bitmap = self._union("upload_date", self.days[start:stop])
+            combined = bitmap if combined is None else combined & bitmap
+        return None if combined is None else LabelFilter(combined)
+
+
+def pq_subvectors(dimension, m=PQ_M):
+    """Largest sub-vector count up to m that divides the dimension."""
+    return next(n for n in range(min(m, dimension), 0, -1) if dimension % n == 0)
+
+
+class VectorIndex:
+    """Vectors keyed by string id, with their chunk metadata.
+
+    Every vector gets a stable int64 label, so removals never renumber the
+    rest. exact_vectors, if set, maps a list of ids to their full-precision
+    vectors; it is used to re-rank quantized results and to retrain.
+    Not thread-safe on its own; KnowledgeIndex guards it with its
+    reader/writer lock.
+    """
+
+    def __init__(self, dimension, index_type="auto", nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH,
+                 quantization=None, exact_vectors=None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.dimension = dimension
+        self.index_type = index_type
+        self.quantization = quantization
+        self.exact_vectors = exact_vectors
+        # Quantization of the current FAISS index (PQ may have fallen back to sq8)
+        self.codes = None
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.kind = None
+        self.index = None
+        self.trained_on = 0
+        self.metadata = {}
+        self.labels = {}
+        self.ids = {}
+        self.next_label = 0
+        # Labels removed from an HNSW graph but still present in it
+        self.deleted = set()
+        self._mask = None
+        self.attributes = AttributeBitmaps()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, vector_id):
+        return vector_id in self.labels
+
+    def __getstate__(self):
+        # The FAISS index is saved separately with faiss.write_index
+        state = dict(self.__dict__)
+        state['index'] = None
+        state['_mask'] = None
+        state['exact_vectors'] = None
+        return state
+
+    def get(self, vector_id):
+        return self.metadata.get(vector_id)
+
+    def _plan(self, count):
+        """(index structure, quantization) to use for count vectors."""
+        kind = self.index_type
+        if kind == "auto":
+            kind = choose_index_type(count, self.kind)
+        if kind == "ivf" and count < IVF_MIN_TRAINING_POINTS:
+            # Too little data to train centroids; stay exact until there is
+            kind = "flat"
+        codes = self.quantization
+        if codes == "pq" and count < PQ_MIN_TRAINING_POINTS:
+            codes = "sq8"
+        if codes == "sq8" and not count:
+            codes = None
+        return kind, codes
+
+    def _build(self, labels, vectors):
+        """Return a new FAISS index holding the vectors."""
+        kind, codes = self._plan(len(vectors))
+        encoding = {None: "Flat", "sq8": "SQ8", "pq": f"PQ{pq_subvectors(self.dimension)}"}[codes]
+        if kind == "ivf":
+            # Direct map: needed for removal and reconstruction by label
+            description = f"IVF{ivf_nlist(len(vectors))},{encoding}"
+        elif kind == "hnsw":
+            description = f"IDMap2,HNSW{HNSW_M}" + (f"_{encoding}" if codes else "")
+        else:
+            description = f"IDMap2,{encoding}"
+        index = faiss.index_factory(self.dimension, description)
+        if kind == "hnsw":
+            faiss.downcast_index(index.index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        if not index.is_trained:
+            index.train(vectors)
+            self.trained_on = len(vectors)
+        else:
+            self.trained_on = 0
+        if kind == "ivf":
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        if len(vectors):
+            index.add_with_ids(vectors, labels)
+        self.kind = kind
+        self.codes = codes
+        self.deleted = set()
+        self._mask = None
+        return index
+
+    def _exact(self, labels):
+        """Full-precision vectors for the given labels, in order."""
+        if self.codes and self.exact_vectors is not None:
+            found = self.exact_vectors([self.ids[int(label)] for label in labels])
+            if len(found) == len(labels):
+                return np.asarray([found[self.ids[int(label)]] for label in labels], dtype='float32')
+        # Lossy when the index is quantized and no exact vectors are available
+        return self.index.reconstruct_batch(np.asarray(labels, dtype='int64'))
+
+    def _live(self):
+        labels = np.fromiter(self.ids, dtype='int64', count=len(self.ids))
+        if not len(labels):
+            return labels, np.empty((0, self.dimension), dtype='float32')
+        return labels, self._exact(labels)
+
+    def restructure(self, force=False):
+        """Convert or compact the FAISS index when the corpus calls for it.
+
+        Returns True if the index was rebuilt.
+        """
+        if self.index is None:
+            return False
+        count = len(self.labels)
+        stale = (
+            force
+            or self._plan(count) != (self.kind, self.codes)
+            or (self.trained_on and count >= self.trained_on * RETRAIN_GROWTH)
+            or (self.kind == "hnsw" and len(self.deleted) > HNSW_MAX_DELETED_RATIO * max(self.index.ntotal, 1))
+        )
+        if not stale:
+            return False
+        labels, vectors = self._live()
+        self.index = self._build(labels, vectors)
+        return True
+
+    def add(self, ids, vectors, metadatas):
+        vectors = np.asarray(vectors, dtype='float32')
+        labels = np.arange(self.next_label, self.next_label + len(ids), dtype='int64')
+        self.next_label += len(ids)
+        for vector_id, label, metadata in zip(ids, labels, metadatas):
+            label = int(label)
+            self.labels[vector_id] = label
+            self.ids[label] = vector_id
+            self.metadata[vector_id] = metadata
+        self.attributes.add(labels, metadatas)
+        if self.index is None:
+            self.index = self._build(labels, vectors)
+        else:
+            self.index.add_with_ids(vectors, labels)
+            self.restructure()
+
+    def remove(self, ids):
+        labels = [self.labels.pop(vector_id) for vector_id in ids if vector_id in self.labels]
+        self.attributes.remove(labels, [self.metadata.get(self.ids[label]) for label in labels])
+        for label in labels:
+            self.metadata.pop(self.ids.pop(label), None)
+        if not labels or self.index is None:
+            return
+        if self.kind == "hnsw":
+            self.deleted.update(labels)
+            self._mask = None
+        else:
+            self.index.remove_ids(np.array(labels, dtype='int64'))
+        self.restructure()
+
+    def _search_parameters(self, allowed=None, widen=1):
+        selector = None
+        if allowed is not None:
+            # Removed labels are already cleared from the attribute bitmaps
+            selector = allowed.selector()
+        elif self.deleted:
+            if self._mask is None:
+                self._mask = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(self.deleted, dtype='int64')))
+            selector = self._mask
+        if self.kind == "ivf":
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe * widen)
+        if self.kind == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=max(self.ef_search, 1) * widen)
+        return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+    def filter(self, filters):
+        """LabelFilter for a filters dict (see AttributeBitmaps.select), or None."""
+        return self.attributes.select(filters)
+
+    def _rank_exactly(self, query, k, labels):
+        distances = ((self._exact(labels) - query) ** 2).sum(axis=1)
+        best = np.argsort(distances)[:k]
+        return [(int(labels[i]), float(distances[i])) for i in best]
+
+    def _approximate(self, query, k, allowed=None, widen=1):
+        # Quantized distances are approximate: over-fetch, then re-rank exactly
+        n = k * RERANK_FACTOR if self.codes else k
+        params = self._search_parameters(allowed, widen)
+        distances, labels = self.index.search(query, min(n, len(self.labels)), params=params)
+        hits = [
+            (int(label), float(distance))
+            for distance, label in zip(distances[0], labels[0])
+            if label >= 0 and int(label) in self.ids
+        ]
+        if self.codes and hits:
+            hits = self._rank_exactly(query, k, [label for label, _ in hits])
+        return hits[:k]
+
+    def search(self, vector, k, allowed=None):
+        """Return up to k (vector_id, L2 distance) pairs, nearest first.
+
+        allowed is a LabelFilter from filter(); only its vectors are returned.
+        """
+        if self.index is None or not self.labels:
+            return []
+        query = np.asarray([vector], dtype='float32')
+        if allowed is None:
+            hits = self._approximate(query, k)
+        elif allowed.count <= FILTER_EXACT_MAX:
+            hits = self._rank_exactly(query, k, allowed.labels()) if allowed.count else []
+        else:
+            # Fewer allowed vectors per cluster or graph neighbourhood: search wider
+            widen = min(FILTER_MAX_WIDEN, max(1, len(self.labels) // allowed.count))
+            hits = self._approximate(query, k, allowed, widen)
+            if len(hits) < min(k, allowed.count) and self.kind != "flat" and widen < FILTER_MAX_WIDEN:
+                # The graph walk or probed clusters held too few allowed vectors
+                hits = self._approximate(query, k, allowed, FILTER_MAX_WIDEN)
+        return [(self.ids[label], distance) for label, distance in hits]
+
+    def memory_usage(self):
+        """Bytes taken by the FAISS index (vectors or codes, graph, centroids)."""
+        if self.index is None:
+            return 0
+        return len(faiss.serialize_index(self.index))
+
+
+def recall_report(vectors, queries, k=10, settings=None):
+    """Measure recall@k and latency of index settings against exact search.
+
+    settings is a list of (index_type, {'nprobe': .., 'ef_search': ..,
+    'quantization': ..}); returns one dict per setting, the exact baseline
+    first. Quantized settings are re-ranked against the given vectors.
+    """
+    vectors = np.asarray(vectors, dtype='float32')
+    queries = np.asarray(queries, dtype='float32')
+    labels = np.arange(len(vectors))
+    if settings is None:
+        settings = [("ivf", {'nprobe': nprobe}) for nprobe in (4, 8, 16, 32, 64)]
+        settings += [("hnsw", {'ef_search': ef}) for ef in (16, 32, 64, 128, 256)]
+        settings += [(index_type, {'quantization': codes}) for index_type in ("flat", "hnsw") for codes in ("sq8", "pq")]
+
+    def exact_vectors(ids):
+        return {vector_id: vectors[vector_id] for vector_id in ids}
+
+    exact = None
+    rows = []
+    for index_type, params in [("flat", {})] + list(settings):
+        index = VectorIndex(vectors.shape[1], index_type, exact_vectors=exact_vectors, **params)
+        index.add(labels.tolist(), vectors, [None] * len(labels))
+        latencies, found = [], []
+        for query in queries:
+            started = time.perf_counter()
+            hits = index.search(query, k)
+            latencies.append(time.perf_counter() - started)
+            found.append({label for label, _ in hits})
+        if exact is None:
+            exact = found
+        recall = np.mean([len(hits & truth) / max(len(truth), 1) for hits, truth in zip(found, exact)])
+        latencies.sort()
+        rows.append({
+            'index_type': index.kind,
+            'params': dict(params, quantization=index.codes) if index.codes else params,
+            'bytes_per_vector': index.memory_usage() / max(len(vectors), 1),
+            'recall': float(recall),
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+        })
+    return rows
+
+
+def main():
+    from knowledge_index import CHUNKS_FILE, INDEX_DIR, MANIFEST_FILE, ChunkStore
+
+    parser = argparse.ArgumentParser(description="Recall, latency and size of index settings on the saved index.")
+    parser.add_argument("--report", action="store_true", help="run the recall/latency report")
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--queries", type=int, default=200, help="stored vectors reused as queries")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+    if not args.report:
+        parser.print_help()
+        return
+
+    with open(os.path.join(args.index_dir, MANIFEST_FILE), "r", encoding='utf-8') as f:
+        manifest = json.load(f)
+    directory = os.path.join(args.index_dir, manifest['directory'])
+    with open(os.path.join(directory, "index.pkl"), "rb") as f:
+        vector_index = pickle.load(f)[0]
+    vector_index.index = faiss.read_index(os.path.join(directory, "index.faiss"))
+    vector_index.exact_vectors = ChunkStore(os.path.join(args.index_dir, CHUNKS_FILE)).get_vectors
+    _, vectors = vector_index._live()
+    if not len(vectors):
+        print("The index is empty")
+        return
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    # Nudge the queries off the stored points so they are not trivially found
+    queries = queries + rng.normal(0, 0.01, queries.shape).astype('float32')
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, recall@{args.k} against exact search")
+    print(f"{'index':<6} {'params':<18} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'bytes/vec':>10}")
+    for row in recall_report(vectors, queries, k=args.k):
+        params = ", ".join(f"{key}={value}" for key, value in row['params'].items())
+        print(
+            f"{row['index_type']:<6} {params:<18} {row['recall']:>7.3f} {row['p50_ms']:>8.2f} "
+            f"{row['p95_ms']:>8.2f} {row['bytes_per_vector']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Streaming assembly of WAV segments into one WAV file.
+
+Segments are decoded to PCM frames and written after a single header, a
+chunk at a time, so memory use does not depend on the podcast's length.
+Segments whose rate, channel count or sample width differ from the output
+are converted on the fly.
+"""
+import struct
+import wave
+
+import numpy as np
+
+# Frames read from a segment at a time
+CHUNK_FRAMES = 64 * 1024
+
+
+def wav_header(data_bytes, channels, sample_width, rate):
+    """A canonical 44-byte PCM WAV header for data_bytes of sample data."""
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_bytes, b"WAVE",
+        b"fmt ", 16, 1, channels, rate, rate * block_align, block_align, sample_width * 8,
+        b"data", data_bytes,
+    )
+
+
+def wav_format(path):
+    """(channels, sample_width, rate, frames) of a WAV file."""
+    with wave.open(path, "rb") as segment:
+        return segment.getnchannels(), segment.getsampwidth(), segment.getframerate(), segment.getnframes()
+
+
+def decode_frames(data, channels, sample_width):
+    """PCM bytes -> float32 array of shape (frames, channels) in [-1, 1)."""
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+    elif sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(values >= 1 << 23, values - (1 << 24), values).astype(np.float32) / (1 << 23)
+    elif sample_width == 4:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+    return samples.reshape(-1, channels)
+
+
+def encode_frames(samples, sample_width):
+    """float32 array of shape (frames, channels) -> little-endian PCM bytes."""
+    samples = np.clip(samples.reshape(-1), -1, 1 - 1e-7)
+    if sample_width == 1:
+        return (samples * 128 + 128).astype(np.uint8).tobytes()
+    if sample_width == 2:
+        return (samples * 32768).astype("<i2").tobytes()
+    if sample_width == 3:
+        values = (samples * (1 << 23)).astype(np.int32)
+        return np.stack([values & 0xFF, (values >> 8) & 0xFF, (values >> 16) & 0xFF], axis=1).astype(np.uint8).tobytes()
+    if sample_width == 4:
+        return (samples.astype(np.float64) * (1 << 31)).astype("<i4").tobytes()
+    raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+
+
+def mix_channels(samples, channels):
+    if samples.shape[1] == channels:
+        return samples
+    mono = samples.mean(axis=1, keepdims=True)
+    return np.repeat(mono, channels, axis=1)
+
+
+def resampled_length(frames, in_rate, out_rate):
+    return -(-frames * out_rate // in_rate)
+
+
+class LinearResampler:
+    """Linear-interpolation resampler that works chunk by chunk.
+
+    Output frame j sits at input position j * in_rate / out_rate; exactly
+    resampled_length(frames, ...) frames come out once finish() is called.
+    """
+
+    def __init__(self, in_rate, out_rate, total_frames):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.total_out = resampled_length(total_frames, in_rate, out_rate)
+        self.next_out = 0
+        self.offset = 0
+        self.previous = None
+
+    def _interpolate(self, frames, first, stop, last_index):
+        positions = np.arange(self.next_out, stop, dtype=np.int64) * self.in_rate
+        index = positions // self.out_rate
+        fraction = ((positions % self.out_rate) / self.out_rate).astype(np.float32)[:, None]
+        # frames starts at input index first
+        left = frames[np.minimum(index, last_index) - first]
+        right = frames[np.minimum(index + 1, last_index) - first]
+        self.next_out = stop
+        return left + (right - left) * fraction
+
+    def process(self, chunk):
+        if not len(chunk):
+            return chunk
+        frames = chunk if self.previous is None else np.concatenate([self.previous, chunk])
+        first = self.offset - (0 if self.previous is None else 1)
+        self.offset += len(chunk)
+        self.previous = chunk[-1:]
+        # Outputs whose right-hand neighbour has already arrived
+        stop = min(self.total_out, ((self.offset - 1) * self.out_rate - 1) // self.in_rate + 1)
+        if stop <= self.next_out:
+            return frames[:0]
+        return self._interpolate(frames, first, stop, self.offset - 1)
+
+    def finish(self):
+        if self.previous is None or self.next_out >= self.total_out:
+            return np.zeros((0, 0 if self.previous is None else self.previous.shape[1]), dtype=np.float32)
+        return self._interpolate(self.previous, self.offset - 1, self.total_out, self.offset - 1)
+
+
+def iter_wav(paths, channels=None, sample_width=None, rate=None, chunk_frames=CHUNK_FRAMES):
+    """Yield one valid WAV file, header first, assembled from the given WAV files.
+
+    The output format defaults to that of the first file. Sizes are worked
+    out before any audio is read, so the header is exact and the bytes can
+    go straight to a non-seekable stream such as an HTTP response.
+    """
+    formats = [wav_format(path) for path in paths]
+    if not formats:
+        raise ValueError("No audio segments to assemble")
+    channels = channels or formats[0][0]
+    sample_width = sample_width or formats[0][1]
+    rate = rate or formats[0][2]
+    block_align = channels * sample_width
+    total = sum(resampled_length(frames, in_rate, rate) for _, _, in_rate, frames in formats)
+    yield wav_header(total * block_align, channels, sample_width, rate)
+
+    for path, (in_channels, in_width, in_rate, frames) in zip(paths, formats):
+        with wave.open(path, "rb") as segment:
+            if (in_channels, in_width, in_rate) == (channels, sample_width, rate):
+                # Already in the output format: copy the frames through
+                for data in iter(lambda: segment.readframes(chunk_frames), b""):
+                    yield data
+                continue
+            resampler = LinearResampler(in_rate, rate, frames) if in_rate != rate else None
+            for data in iter(lambda: segment.readframes(chunk_frames), b""):
+                samples = mix_channels(decode_frames(data, in_channels, in_width), channels)
+                if resampler is not None:
+                    samples = resampler.process(samples)
+                if len(samples):
+                    yield encode_frames(samples, sample_width)
+            if resampler is not None:
+                tail = resampler.finish()
+                if len(tail):
+                    yield encode_frames(tail, sample_width)
+
+
+def write_wav(paths, out, **options):
+    """Assemble paths into the binary file object out; returns bytes written."""
+    written = 0
+    for data in iter_wav(paths, **options):
+        out.write(data)
+        written += len(data)
+    return written